@@ -56,13 +56,33 @@
     事件通知函数，ZCANPRO程序会在产生相应事件的时候调用该接口通知运行的脚本。
     * type: 事件类型，字符串类型，目前支持的类型如下
         a) "stop": 停止脚本运行，接收到该命令后应让z_main函数立即运行结束。
+        b) "profile_start"\"profile_stop": 本脚本扩展，开始\停止cProfile统计z_main循环，停止后统计写入ProfileFile，耗时最多的函数写入日志。
 
 """
 
 import os
 import configparser
 import time
-import zcanpro
+import random
+import hashlib
+import threading
+import collections
+import heapq
+import struct
+import cProfile
+import pstats
+import sqlite3
+
+try:
+    import zcanpro
+except ImportError:
+    #offline use, eg:decode capture file
+    zcanpro = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 #--------------------------------------------------------class--------------------------------------------------------#
 crcm32TableEx = \
@@ -168,6 +188,181 @@ def CalCrc32Ex(datalist, size, initvalue):
 
     return crc
 
+#crc of size zero bytes is linear, keep image of each crc bit
+crcShift = {}
+def GetCrcShift(table, size):
+    key = (id(table), size)
+
+    if key not in crcShift:
+        shift = []
+        for bit in range(32):
+            crc = 1 << bit
+            for index in range(size):
+                crc = table[crc & 0xFF] ^ (crc >> 8)
+            shift.append(crc)
+
+        crcShift[key] = shift
+
+    return crcShift[key]
+
+#same as running crc through size zero bytes
+def CalCrcShift(shift, crc):
+    result = 0
+    bit = 0
+    while crc:
+        if crc & 1:
+            result ^= shift[bit]
+        crc >>= 1
+        bit += 1
+
+    return result
+
+#crc change caused by one byte xor-diff followed by tail bytes, crc is linear so new = old ^ delta
+crcDeltaTab = {}
+def GetCrcDeltaTab(table, tail):
+    key = (id(table), tail)
+
+    if key not in crcDeltaTab:
+        shift = GetCrcShift(table, tail)
+        crcDeltaTab[key] = [CalCrcShift(shift, table[diff]) for diff in range(256)]
+
+    return crcDeltaTab[key]
+
+#fix crc of datalist[start:end] after bytes changed, oldlist is the data before change
+def CalCrcDelta(table, crc, oldlist, datalist, start, end):
+    for index in range(start, end):
+        diff = (oldlist[index] ^ datalist[index]) & 0xFF
+        if diff:
+            crc ^= GetCrcDeltaTab(table, end - 1 - index)[diff]
+
+    return crc
+
+#crc is linear over GF(2), xor x into free bytes changes crc by M*x, keep M^-1 to hit any crc
+#frame layout: value 14-55 under crcm, 0-59 under crc; crcm bits low, crc bits high when both forged
+crcForgeInv = {}
+def GetCrcForgeInv(freePos, crcmFlag, crcFlag):
+    key = (freePos, crcmFlag, crcFlag)
+
+    if key not in crcForgeInv:
+        rows = []
+        for index in range(len(freePos)):
+            pos = freePos[index]
+            for bit in range(8):
+                col = 0
+                width = 0
+                if crcmFlag:
+                    if 14 <= pos < 56:
+                        col = GetCrcDeltaTab(crcm32TableEx, 55 - pos)[1 << bit]
+                    width = 32
+                if crcFlag:
+                    col |= GetCrcDeltaTab(crc32TableEx, 59 - pos)[1 << bit] << width
+                rows.append([col, 1 << (index * 8 + bit)])
+
+        #gauss-jordan, pivot row of each crc bit ends as that bit alone, its free bits are the inverse
+        inverse = []
+        for outBit in range(32 * (int(crcmFlag) + int(crcFlag))):
+            pivot = None
+            for row in rows:
+                if (row[0] >> outBit) & 1:
+                    pivot = row
+                    break
+            if None == pivot:
+                inverse = None
+                break
+
+            rows.remove(pivot)
+            for row in rows + inverse:
+                if (row[0] >> outBit) & 1:
+                    row[0] ^= pivot[0]
+                    row[1] ^= pivot[1]
+            inverse.append(pivot)
+
+        crcForgeInv[key] = None if None == inverse else [row[1] for row in inverse]
+
+    return crcForgeInv[key]
+
+#change free bytes of frame so crcm of value\crc of 0-59 get target, None target not forced
+def CalCrcForge(frame, crcmTarget, crcTarget, freePos):
+    inverse = GetCrcForgeInv(freePos, None != crcmTarget, None != crcTarget)
+    if None == inverse:
+        return -1
+
+    want = 0
+    width = 0
+    if None != crcmTarget:
+        want = CalCrcm32Ex(frame[14:56], 42, crcm32exInit) ^ crcmTarget
+        width = 32
+    if None != crcTarget:
+        want |= (CalCrc32Ex(frame, 60, crc32exInit) ^ crcTarget) << width
+
+    x = CalCrcShift(inverse, want)
+    for index in range(len(freePos)):
+        frame[freePos[index]] ^= (x >> (8 * index)) & 0xFF
+
+    return 0
+
+#"target@pos" of CrcM\Crc, eg:0x12345678@52, None if plain value
+def ParseCrcForge(crcIn):
+    if "@" not in crcIn:
+        return None
+    target, pos = crcIn.split("@")
+    return int(target, 0) & 0xFFFFFFFF, int(pos, 0)
+
+#64 byte frame with value crcm in place, CrcM\Crc from Test section, forged ones solved together
+def CrcForgeFrame(frame, crcmIn, crcIn):
+    crcmForge = ParseCrcForge(crcmIn)
+    crcForge = ParseCrcForge(crcIn)
+    crcmTarget = None
+    crcTarget = None
+    freePos = ()
+
+    if None != crcmForge:
+        crcmTarget, pos = crcmForge
+        freePos += tuple(range(pos, pos + 4))
+        frame[56:60] = crcmTarget.to_bytes(4, "little")
+    elif "NULL" != crcmIn:
+        frame[56:60] = (int(crcmIn) & 0xFFFFFFFF).to_bytes(4, "little")
+
+    if None != crcForge:
+        crcTarget, pos = crcForge
+        freePos += tuple(range(pos, pos + 4))
+
+    CalCrcForge(frame, crcmTarget, crcTarget, freePos)
+
+    if None != crcForge:
+        crc = crcTarget
+    elif "NULL" != crcIn:
+        crc = int(crcIn) & 0xFFFFFFFF
+    else:
+        crc = CalCrc32Ex(frame, 60, crc32exInit)
+    frame[60:64] = crc.to_bytes(4, "little")
+
+    return list(frame)
+
+#CrcM forge bytes in value 14-55, Crc forge bytes in 0-55, not overlapped
+def CheckCrcForge(crcmIn, crcIn):
+    try:
+        crcmForge = ParseCrcForge(crcmIn)
+        crcForge = ParseCrcForge(crcIn)
+    except ValueError:
+        return -1
+
+    freePos = ()
+    if None != crcmForge:
+        if 14 > crcmForge[1] or 52 < crcmForge[1]:
+            return -1
+        freePos += tuple(range(crcmForge[1], crcmForge[1] + 4))
+    if None != crcForge:
+        if 0 > crcForge[1] or 52 < crcForge[1]:
+            return -1
+        freePos += tuple(range(crcForge[1], crcForge[1] + 4))
+
+    if 0 == len(freePos):
+        return 0
+    if len(set(freePos)) != len(freePos) or None == GetCrcForgeInv(freePos, None != crcmForge, None != crcForge):
+        return -1
+    return 0
+
 def IsSubString(SubStrList, Str):
     flag = True
     for substr in SubStrList:
@@ -184,6 +379,152 @@ def GetFileList(FindPath, FlagStr):
             fullfilename = os.path.join(FindPath, fn)
             FileList.append(fullfilename)
     return FileList
+#--------------------------------------------------------clock--------------------------------------------------------#
+class RealClock:
+    #--------------------------interface--------------------------#
+    def now(self):
+        return time.perf_counter()
+
+    def sleep(self, sleepTime):
+        time.sleep(sleepTime)
+
+
+#time only goes on when slept, plans run as fast as cpu can
+class VirtualClock:
+    #--------------------------property--------------------------#
+    nowTime = 0.0
+
+    #--------------------------interface--------------------------#
+    def now(self):
+        return self.nowTime
+
+    def sleep(self, sleepTime):
+        if 0 < sleepTime:
+            self.nowTime += sleepTime
+
+
+clock = RealClock()
+
+#--------------------------------------------------------log--------------------------------------------------------#
+class LogSink:
+    #--------------------------property--------------------------#
+    period = 0.05
+    maxRepeat = 1000
+    __rate = 20
+    __queue = 0
+    __event = 0
+    __thread = 0
+    __stopFlag = False
+    __file = None
+    __repeat = {}
+    __second = 0
+    __secondNum = 0
+    __dropNum = 0
+
+    #--------------------------init--------------------------#
+
+    def __init__(self):
+        self.__queue = collections.deque(maxlen=100000)
+        self.__event = threading.Event()
+        self.__thread = threading.Thread(target=self.__loop, daemon=True)
+        self.__repeat = {}
+
+    #--------------------------interface--------------------------#
+    def start(self):
+        self.__thread.start()
+
+    def stop(self):
+        self.__stopFlag = True
+        self.__event.set()
+        self.__thread.join()
+
+        if None != self.__file:
+            self.__file.close()
+            self.__file = None
+
+    def config(self, rate, fileName):
+        self.__rate = rate
+        if "NULL" != fileName:
+            try:
+                self.__file = open(fileName, "a", encoding="utf-8")
+            except:
+                self.write("Cant open log file " + fileName)
+
+    #only queue in caller thread
+    def write(self, msg):
+        self.__queue.append((time.time(), msg))
+
+    #--------------------------method--------------------------#
+    def __loop(self):
+        while True:
+            self.__event.wait(self.period)
+            self.__event.clear()
+            self.__drain()
+
+            if self.__stopFlag:
+                self.__drain()
+                self.__reset_rate()
+                self.__flush_repeat()
+                self.__reset_rate()
+                break
+
+    def __drain(self):
+        while self.__queue:
+            stamp, msg = self.__queue.popleft()
+
+            if None != self.__file:
+                self.__file.write(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(stamp))
+                                  + ".%03d " % (int(stamp * 1000) % 1000) + msg + "\n")
+
+            #same log in one second only shown once, then as count
+            if msg in self.__repeat:
+                self.__repeat[msg] += 1
+                continue
+
+            if len(self.__repeat) >= self.maxRepeat:
+                self.__flush_repeat()
+            self.__repeat[msg] = 0
+            self.__emit(msg)
+
+        #new second gets the summaries of the last one
+        if int(time.time()) != self.__second:
+            self.__reset_rate()
+            self.__flush_repeat()
+
+        if None != self.__file:
+            self.__file.flush()
+
+    #repeat counts as summary lines, still under the rate limit
+    def __flush_repeat(self):
+        for msg, repeatNum in self.__repeat.items():
+            if 0 < repeatNum:
+                self.__emit(msg + " (repeat " + str(repeatNum) + ")")
+        self.__repeat.clear()
+
+    #only when the second really changes
+    def __reset_rate(self):
+        if 0 < self.__dropNum:
+            zcanpro.write_log("Log rate limit, drop " + str(self.__dropNum))
+
+        self.__second = int(time.time())
+        self.__secondNum = 0
+        self.__dropNum = 0
+
+    def __emit(self, msg):
+        if self.__secondNum < self.__rate:
+            zcanpro.write_log(msg)
+            self.__secondNum += 1
+        else:
+            self.__dropNum += 1
+
+
+logSink = None
+def WriteLog(msg):
+    if None == logSink:
+        zcanpro.write_log(msg)
+    else:
+        logSink.write(msg)
+
 #--------------------------------------------------------class--------------------------------------------------------#
 
 class IniParser:
@@ -196,6 +537,8 @@ class IniParser:
     __CommIndex = 0
     __TestFinish = False
     __Mode = 0
+    __IniFile = "NULL"
+    __OnTestChange = None
 
     #--------------------------init--------------------------#
 
@@ -228,6 +571,10 @@ class IniParser:
 
         return Result
 
+    #use this file instead of searching D:/TestComm
+    def SetIniFile(self, fileName):
+        self.__IniFile = fileName
+
     def AddCommIndex(self):
         self.__CommIndex += 1
         self.__CheckAndChange()
@@ -247,25 +594,50 @@ class IniParser:
     def GetMode(self):
         return self.__Mode
 
+    def GetTestName(self):
+        return "Test" + str(self.__TestIndex)
+
+    #callback(test name) right when comm index goes into next test section
+    def SetTestChange(self, callback):
+        self.__OnTestChange = callback
+
+    def GetSection(self, name):
+        if self.__IniPar.has_section(name):
+            return self.__IniPar[name]
+        return None
+
+    #same plan file content, same hash
+    def GetPlanHash(self):
+        planHash = hashlib.md5()
+        for fileName in self.__FileList:
+            with open(fileName, "rb") as planFile:
+                planHash.update(planFile.read())
+        return planHash.hexdigest()
+
     #--------------------------method--------------------------#
 
     def __GetIniFile(self):
+        if "NULL" != self.__IniFile:
+            self.__FileList = [self.__IniFile]
+            WriteLog(str(self.__FileList))
+            return 0
+
         # FindPath = os.getcwd()
         FindPath = "D:/TestComm"
 
         FlagStr = ['ini']
         self.__FileList = GetFileList(FindPath, FlagStr)
 
-        zcanpro.write_log(FindPath)
+        WriteLog(FindPath)
 
         if 0 == len(self.__FileList):
-            zcanpro.write_log("No ini file, Plesse add one ini file")
+            WriteLog("No ini file, Plesse add one ini file")
             return -1
         elif 1 < len(self.__FileList):
-            zcanpro.write_log("More than one ini files, Please leave one ini file!")
+            WriteLog("More than one ini files, Please leave one ini file!")
             return -1
         else:
-            zcanpro.write_log(str(self.__FileList))
+            WriteLog(str(self.__FileList))
             return 0
 
     def __CheckIniFile(self):
@@ -273,7 +645,7 @@ class IniParser:
         try:
             TestInfo = self.__IniPar["TestInfo"]
         except:
-            zcanpro.write_log("No TestInfo .ini file!")
+            WriteLog("No TestInfo .ini file!")
             return -1
 
         try:
@@ -282,9 +654,9 @@ class IniParser:
             TestInfo["MorS"]
             TestInfo["UseCha"]
             TestNum = TestInfo["TestNum"]
-            zcanpro.write_log("TestNum :"+TestNum)
+            WriteLog("TestNum :"+TestNum)
         except:
-            zcanpro.write_log("Less Parm in TestInfo!")
+            WriteLog("Less Parm in TestInfo!")
             return -1
 
         for index in range(int(TestNum)):
@@ -292,7 +664,7 @@ class IniParser:
 
             try:
                 TestIndex = self.__IniPar[Test]
-                zcanpro.write_log(Test)
+                WriteLog(Test)
 
                 try:
                     TestIndex["StrIndex"]
@@ -305,13 +677,13 @@ class IniParser:
                     TestIndex["CandID"]
 
                 except:
-                    zcanpro.write_log("Less Parm in "+Test)
+                    WriteLog("Less Parm in "+Test)
                     return -1
 
             except:
-                zcanpro.write_log("No" + Test)
+                WriteLog("No" + Test)
                 return -1
-        zcanpro.write_log("Check OK")
+        WriteLog("Check OK")
 
         return 0
 
@@ -322,6 +694,8 @@ class IniParser:
                 self.__TestIndex += 1
                 self.__CurTest = self.__IniPar["Test"+str(self.__TestIndex)]
                 self.__CommIndex = int(self.__CurTest["StrIndex"])
+                if None != self.__OnTestChange:
+                    self.__OnTestChange(self.GetTestName())
             else:
                 self.__TestFinish = True
 
@@ -335,10 +709,10 @@ class IniParser:
             else:
                 self.__Mode = "EXE_Mode"
         else:
-            zcanpro.write_log("More than one board in BoardType!")
+            WriteLog("More than one board in BoardType!")
             return -1
 
-        zcanpro.write_log("Mode:" + self.__Mode)
+        WriteLog("Mode:" + self.__Mode)
         return 0
 
 #--------------------------------------------------------class--------------------------------------------------------#
@@ -355,6 +729,11 @@ class BoardParser:
     valueData = []
     crcCrcM = []
     zCanPro = 0
+    faultEng = None
+    profile = None
+    frameData = []
+    replyNum = 0
+    sessionKey = "NULL"
 
     #--------------------------init--------------------------#
 
@@ -382,9 +761,18 @@ class BoardParser:
 
     def send(self, id, useCha):
 
-        data = self.headData + self.valueData + self.crcCrcM
-        for chaIndex in self.channel[useCha]:
-            self.zCanPro.send(chaIndex, id, data)
+        data = self.frameData
+        #SendTimes repeats are one request\reply for the session
+        if None != self.zCanPro.session and (id, self.headStru["Index"]) != self.sessionKey:
+            self.sessionKey = (id, self.headStru["Index"])
+            self.zCanPro.session.add(id, clock.now())
+
+        if None == self.faultEng:
+            self.zCanPro.send_group(self.channel[useCha], id, data)
+        else:
+            for chaIndex in self.channel[useCha]:
+                self.faultEng.send(self.zCanPro, chaIndex, id, data,
+                                   self.headStru["Index"], self.headStru["Type"])
 
 
     #first update headStru from TestX
@@ -417,9 +805,33 @@ class BoardParser:
     def frame_valuedata(self, pkgType):
         pass
 
+    def get_templates(self):
+        if None != self.profile:
+            return self.profile.get_templates()
+        return {}
+
+    #ids, packet types, templates and reply num from profile, own copy of the dicts
+    def use_profile(self, profile):
+        self.profile = profile
+        self.BoardType = profile.boardType
+        self.IDType = dict(self.IDType)
+        self.IDType[profile.boardType] = profile.idType
+        self.IDPkgType = dict(self.IDPkgType)
+        self.IDPkgType.update(profile.pkgType)
+        self.replyNum = profile.replyNum
+
     def frame_crc_crcm(self, crcmIn, crcIn):
         self.crcCrcM.clear()
 
+        if "@" in crcmIn or "@" in crcIn:
+            crcm = CalCrcm32Ex(self.valueData, len(self.valueData), crcm32exInit)
+            frame = CrcForgeFrame(bytearray(self.headData + self.valueData + list(crcm.to_bytes(4, "little")) + [0] * 4),
+                                  crcmIn, crcIn)
+            self.headData = frame[:14]
+            self.valueData = frame[14:56]
+            self.crcCrcM = frame[56:]
+            return
+
         #crcm
         if "NULL" == crcmIn:
             crcm = CalCrcm32Ex(self.valueData, len(self.valueData), crcm32exInit)
@@ -545,7 +957,7 @@ class MSParser(BoardParser):
             self.__sendIndex += 1
             iniPar.AddCommIndex()
 
-            time.sleep(self.__sleepTime)
+            self.zCanPro.wait(self.__sleepTime)
 
     def frame(self, pkgType, timeStamp, index, crcm, crc):
 
@@ -556,10 +968,25 @@ class MSParser(BoardParser):
         self.headStru["Type"] = pkgType
         self.headStru["MorS"] = self.__mOrSValue
 
+        if None != self.profile:
+            self.frameData = self.profile.build(pkgType, timeStamp, index, self.__mOrSValue,
+                                                self.__boardType, self.__sysRunCmd, crcm, crc)
+            return
+
         self.frame_headdata()
         self.frame_valuedata(pkgType)
         self.frame_crc_crcm(crcm, crc)
+        self.frameData = self.headData + self.valueData + self.crcCrcM
+
+
+    def get_templates(self):
+        if None != self.profile:
+            return self.profile.get_templates()
+        return {"State": self.__stateValueData, "Ver": self.__verValueData, "Req": self.__reqValueData}
 
+    def use_profile(self, profile):
+        BoardParser.use_profile(self, profile)
+        self.__pkgType = dict((name, profile.pkgType[name]) for name in self.__pkgType.keys())
 
     def frame_valuedata(self, pkgType):
 
@@ -594,6 +1021,7 @@ class ExeParser(BoardParser):
     verValueData = []
     reqValueData = []
     req2ValueData = []
+    replyCache = None
 
     #--------------------------init--------------------------#
 
@@ -608,11 +1036,19 @@ class ExeParser(BoardParser):
 
         self.__boardType = self.make_board_type(testInfo["BoardType"], testInfo["SysAorB"])
 
+        #idle, build likely next replies ahead
+        if None != self.replyCache and 0 == len(recvData["type"]) and False == iniPar.IsTestFinish():
+            self.__sysRunCmd = 0x3333
+            self.replyCache.prepare(self, iniPar)
+
         if False == iniPar.IsTestFinish() \
                 and len(recvData["type"]) == len(recvData["timeStamp"]) \
                 and 0 < len(recvData["type"]):
 
             for recvIndex in range(len(recvData["type"])):
+                if None != self.replyCache:
+                    self.replyCache.observe(recvData["type"][recvIndex])
+
                 if 1 == self.replyNum or \
                         (2 == self.replyNum and "Req" != recvData["type"][recvIndex]):
 
@@ -640,7 +1076,7 @@ class ExeParser(BoardParser):
                     sendTimes = int(curTest["SendTimes"])
                     useCha = curTest["UseCha"]
 
-                    self.frame(pkgType, timeStamp, index, crcm, crc)
+                    self.reply_frame(pkgType, timeStamp, index, crcm, crc)
 
                     for sendIndex in range(sendTimes):
                         self.send(id, useCha)
@@ -673,7 +1109,7 @@ class ExeParser(BoardParser):
                     sendTimes = int(curTest["SendTimes"])
                     useCha = curTest["UseCha"]
 
-                    self.frame(pkgType, timeStamp, index, crcm, crc)
+                    self.reply_frame(pkgType, timeStamp, index, crcm, crc)
 
                     for sendIndex in range(sendTimes):
                         self.send(id, useCha)
@@ -705,7 +1141,7 @@ class ExeParser(BoardParser):
                     sendTimes = int(curTest["SendTimes"])
                     useCha = curTest["UseCha"]
 
-                    self.frame(pkgType, timeStamp, index, crcm, crc)
+                    self.reply_frame(pkgType, timeStamp, index, crcm, crc)
 
                     for sendIndex in range(sendTimes):
                         self.send(id, useCha)
@@ -724,10 +1160,33 @@ class ExeParser(BoardParser):
         self.headStru["Type"] = pkgType
         self.headStru["MorS"] = 0
 
+        if None != self.profile:
+            self.frameData = self.profile.build(pkgType, timeStamp, index, 0,
+                                                self.__boardType, self.__sysRunCmd, crcm, crc)
+            return
+
         self.frame_headdata()
         self.frame_valuedata(pkgType)
         self.frame_crc_crcm(crcm, crc)
+        self.frameData = self.headData + self.valueData + self.crcCrcM
+
+
+    #pre-built reply if there is one, else build now
+    def reply_frame(self, pkgType, timeStamp, index, crcm, crc):
+        if None == self.replyCache or not self.replyCache.take(self, pkgType, timeStamp, index, crcm, crc):
+            self.frame(pkgType, timeStamp, index, crcm, crc)
+
+    def use_profile(self, profile):
+        BoardParser.use_profile(self, profile)
+        self.pkgType = dict(profile.pkgType)
 
+    def get_templates(self):
+        if None != self.profile:
+            return self.profile.get_templates()
+        templates = {"State": self.stateValueData, "Ver": self.verValueData, "Req": self.reqValueData}
+        if 2 == self.replyNum:
+            templates["Req2"] = self.req2ValueData
+        return templates
 
     def frame_valuedata(self, pkgType):
 
@@ -822,7 +1281,10 @@ class DOParser(ExeParser):
         self.reqValueData.clear()
         self.reqValueData.extend(self.__reqValueData)
 
+        #own copy, dont change the shared dicts
+        self.IDPkgType = dict(self.IDPkgType)
         self.IDPkgType["Req"] = 5
+        self.pkgType = dict(self.pkgType)
         self.pkgType["Req"] = 5
 
     #--------------------------interface--------------------------#
@@ -920,12 +1382,1915 @@ class AIParser(ExeParser):
     # --------------------------method--------------------------#
 
 
+#--------------------------------------------------------board profile--------------------------------------------------------#
+class BoardProfile:
+    #--------------------------property--------------------------#
+    valueLen = 42
+    #crc runs over head 14 + value 42 + crcm 4, head crc shifted over the 46 bytes after it
+    headShift = GetCrcShift(crc32TableEx, 46)
+    boardType = "NULL"
+    idType = 0
+    role = "Exe"
+    replyNum = 1
+    pkgType = {}
+    pkgName = {}
+    templates = {}
+    boardOffset = {}
+    cmdOffset = {}
+    #(pkg number, board, sysRunCmd) -> (value + crcm bytes, crc of them from 0)
+    compiled = {}
+
+    #--------------------------init--------------------------#
+
+    def __init__(self, boardType, idType, role, replyNum):
+        self.boardType = boardType
+        self.idType = idType
+        self.role = role
+        self.replyNum = replyNum
+        self.pkgType = {}
+        self.pkgName = {}
+        self.templates = {}
+        self.boardOffset = {}
+        self.cmdOffset = {}
+        self.compiled = {}
+
+    #--------------------------interface--------------------------#
+    def add_pkg(self, name, number, template, boardOffset, cmdOffset):
+        if self.valueLen != len(template):
+            raise ValueError(name + " value len " + str(len(template)))
+        if "NULL" != boardOffset and not 0 <= boardOffset < self.valueLen:
+            raise ValueError(name + " BoardByte " + str(boardOffset) + ", value byte 0-" + str(self.valueLen - 1))
+        if "NULL" != cmdOffset and not 0 <= cmdOffset <= self.valueLen - 2:
+            raise ValueError(name + " SysRunCmd " + str(cmdOffset) + ", value byte 0-" + str(self.valueLen - 2))
+
+        self.pkgType[name] = number
+        self.pkgName[number] = name
+        self.templates[name] = bytes(template)
+        self.boardOffset[name] = boardOffset
+        self.cmdOffset[name] = cmdOffset
+
+    def get_templates(self):
+        return dict((name, list(template)) for name, template in self.templates.items())
+
+    #every pkg for board A\B and both sysRunCmd the parsers send, so run never compiles
+    def compile_known(self):
+        for pkgType in self.pkgName.keys():
+            for aOrB in range(2):
+                for sysRunCmd in (0x1111, 0x3333):
+                    self.compile((pkgType, self.idType * 2 + aOrB, sysRunCmd))
+
+    #whole 64 byte frame, crcmIn\crcIn: "NULL" or value from Test section
+    def build(self, pkgType, timeStamp, index, mOrS, board, sysRunCmd, crcmIn, crcIn):
+        key = (pkgType, board, sysRunCmd)
+        if key not in self.compiled:
+            self.compile(key)
+        valueCrcM, valueCrc = self.compiled[key]
+
+        head = (timeStamp & 0xFFFFFFFFFFFFFFFF).to_bytes(8, "little") + (index & 0xFFFF).to_bytes(2, "little") \
+               + b"\x40\x00" + bytes([pkgType & 0xFF, mOrS & 0xFF])
+
+        if "@" in crcmIn or "@" in crcIn:
+            return CrcForgeFrame(bytearray(head + valueCrcM + bytes(4)), crcmIn, crcIn)
+
+        if "NULL" != crcmIn:
+            valueCrcM = valueCrcM[:self.valueLen] + (int(crcmIn) & 0xFFFFFFFF).to_bytes(4, "little")
+            valueCrc = CalCrc32Ex(valueCrcM, len(valueCrcM), 0)
+
+        if "NULL" == crcIn:
+            crc = CalCrcShift(self.headShift, CalCrc32Ex(head, len(head), crc32exInit)) ^ valueCrc
+        else:
+            crc = int(crcIn) & 0xFFFFFFFF
+
+        return list(head + valueCrcM + crc.to_bytes(4, "little"))
+
+    #--------------------------method--------------------------#
+    def compile(self, key):
+        pkgType, board, sysRunCmd = key
+        name = self.pkgName[pkgType]
+        value = bytearray(self.templates[name])
+
+        if "NULL" != self.boardOffset[name]:
+            value[self.boardOffset[name]] = board & 0xFF
+        if "NULL" != self.cmdOffset[name]:
+            value[self.cmdOffset[name]] = sysRunCmd & 0xFF
+            value[self.cmdOffset[name] + 1] = (sysRunCmd >> 8) & 0xFF
+
+        crcm = CalCrcm32Ex(value, len(value), crcm32exInit)
+        valueCrcM = bytes(value) + crcm.to_bytes(4, "little")
+        self.compiled[key] = (valueCrcM, CalCrc32Ex(valueCrcM, len(valueCrcM), 0))
+
+
+#profile file, see Profiles/*.prf
+def LoadBoardProfile(fileName):
+    prfPar = configparser.ConfigParser()
+    prfPar.optionxform = str
+
+    try:
+        prfPar.read(fileName)
+        board = prfPar["Board"]
+        profile = BoardProfile(board["BoardType"], int(board["IDType"]), board["Role"], int(board["ReplyNum"]))
+        if profile.role not in ("Master", "Exe"):
+            raise ValueError("Role " + profile.role + ", Master or Exe")
+        if profile.replyNum not in (1, 2):
+            raise ValueError("ReplyNum " + str(profile.replyNum) + ", 1 or 2")
+
+        for name, number in prfPar["PkgType"].items():
+            pkg = prfPar[name]
+            template = [int(byte, 16) for byte in pkg["Value"].split()]
+            boardOffset = pkg.get("BoardByte", "NULL")
+            cmdOffset = pkg.get("SysRunCmd", "NULL")
+            profile.add_pkg(name, int(number), template,
+                            boardOffset if "NULL" == boardOffset else int(boardOffset),
+                            cmdOffset if "NULL" == cmdOffset else int(cmdOffset))
+
+        needPkg = ["State", "Ver", "Req"] + (["Req2"] if 2 == profile.replyNum else [])
+        for name in needPkg:
+            if name not in profile.pkgType:
+                raise ValueError("no " + name + " in PkgType")
+    except Exception as err:
+        WriteLog("Bad board profile " + fileName + " " + str(err))
+        return None
+
+    WriteLog("Board profile " + profile.boardType + " from " + fileName)
+    return profile
+
+#built in board classes get the same fast framing
+def MakeBoardProfile(bdPar):
+    role = "Master" if "MS" == bdPar.BoardType else "Exe"
+    profile = BoardProfile(bdPar.BoardType, bdPar.IDType[bdPar.BoardType], role, max(bdPar.replyNum, 1))
+
+    for name, template in bdPar.get_templates().items():
+        if "State" == name:
+            boardOffset, cmdOffset = 0, 20
+        elif "Ver" == name or ("Req" == name and "Master" == role):
+            boardOffset, cmdOffset = 0, "NULL"
+        else:
+            boardOffset, cmdOffset = "NULL", "NULL"
+        profile.add_pkg(name, bdPar.IDPkgType[name], template, boardOffset, cmdOffset)
+
+    return profile
+
+#board from ProfileDir\<BoardType>.prf, else built in class, with compiled profile
+def MakeBoardParser(boardType, profileDir, zCanPro):
+    profileName = os.path.join(profileDir, boardType + ".prf")
+
+    if "NULL" != profileDir and os.path.exists(profileName):
+        profile = LoadBoardProfile(profileName)
+        if None == profile:
+            return None
+        if "Master" == profile.role:
+            bdPar = MSParser(zCanPro)
+        else:
+            bdPar = ExeParser(zCanPro)
+        bdPar.use_profile(profile)
+    elif "MS" == boardType:
+        bdPar = MSParser(zCanPro)
+    elif "DI" == boardType:
+        bdPar = DIParser(zCanPro)
+    elif "DO" == boardType:
+        bdPar = DOParser(zCanPro)
+    elif "FI" == boardType:
+        bdPar = FIParser(zCanPro)
+    elif "AI" == boardType:
+        bdPar = AIParser(zCanPro)
+    else:
+        WriteLog("Cant Find Board Parser " + boardType)
+        return None
+
+    bdPar.channel = zCanPro.channel
+
+    if None == bdPar.profile:
+        bdPar.use_profile(MakeBoardProfile(bdPar))
+
+    try:
+        bdPar.profile.compile_known()
+    except Exception as err:
+        WriteLog("Bad board profile " + boardType + " " + str(err))
+        return None
+
+    return bdPar
+
+
+
+#--------------------------------------------------------predict--------------------------------------------------------#
+
+#next master type from last one, counted transitions
+class TypePredictor:
+    #--------------------------property--------------------------#
+    #last type -> {next type: count}
+    transit = {}
+    lastType = "NULL"
+
+    #--------------------------init--------------------------#
+
+    def __init__(self):
+        self.transit = {}
+        self.lastType = "NULL"
+
+    #--------------------------interface--------------------------#
+    def observe(self, strType):
+        nextNum = self.transit.setdefault(self.lastType, {})
+        nextNum[strType] = nextNum.get(strType, 0) + 1
+        self.lastType = strType
+
+    #most likely first, State\Ver\Req order before anything seen
+    def predict(self, num):
+        nextNum = self.transit.get(self.lastType, {})
+        strTypes = sorted(("State", "Ver", "Req"), key=lambda strType: -nextNum.get(strType, 0))
+        return strTypes[:num]
+
+
+#EXE replies built while idle, on arrival only time stamp patched and crc fixed
+class ReplyCache:
+    #--------------------------property--------------------------#
+    #crc runs over bytes 0-59, time stamp bytes 0-7
+    crcLen = 60
+    stampLen = 8
+    stampTab = []
+    predictor = 0
+    buildNum = 2
+    #(pkg type, index) -> (frame with time stamp 0, crcm in, crc in)
+    frames = {}
+    readyKey = "NULL"
+    hitNum = 0
+    missNum = 0
+    buildTime = 0
+    buildCount = 0
+    patchTime = 0
+
+    #--------------------------init--------------------------#
+
+    def __init__(self, buildNum):
+        self.buildNum = buildNum
+        self.predictor = TypePredictor()
+        self.frames = {}
+        self.stampTab = [GetCrcDeltaTab(crc32TableEx, self.crcLen - 1 - byte) for byte in range(self.stampLen)]
+
+    #--------------------------interface--------------------------#
+    def observe(self, strType):
+        self.predictor.observe(strType)
+
+    #replies of predicted types at current index, Req also with Req2 at next index
+    def prepare(self, bdPar, iniPar):
+        index = iniPar.GetCommIndex()
+        strTypes = self.predictor.predict(self.buildNum)
+        readyKey = (index, self.predictor.lastType)
+        if readyKey == self.readyKey:
+            return
+        self.readyKey = readyKey
+        self.frames = {}
+
+        curTest = iniPar.GetCurTest()
+        #forged crc depends on time stamp, build on arrival
+        if "@" in curTest["Crc"]:
+            return
+
+        for strType in strTypes:
+            replyTypes = [strType]
+            if 2 == bdPar.replyNum and "Req" == strType:
+                replyTypes.append("Req2")
+
+            for replyIndex in range(len(replyTypes)):
+                pkgType = bdPar.pkgType[replyTypes[replyIndex]]
+                startTime = time.perf_counter()
+                bdPar.frame(pkgType, 0, index + replyIndex, curTest["CrcM"], curTest["Crc"])
+                self.buildTime += time.perf_counter() - startTime
+                self.buildCount += 1
+                self.frames[(pkgType, index + replyIndex)] = (bdPar.frameData, curTest["CrcM"], curTest["Crc"])
+
+    #True with bdPar.frameData set, False if not built ahead
+    def take(self, bdPar, pkgType, timeStamp, index, crcm, crc):
+        startTime = time.perf_counter()
+        item = self.frames.pop((pkgType, index), None)
+        if None == item or crcm != item[1] or crc != item[2]:
+            self.missNum += 1
+            return False
+
+        frame = item[0]
+        data = list((timeStamp & 0xFFFFFFFFFFFFFFFF).to_bytes(self.stampLen, "little")) + frame[self.stampLen:]
+        if "NULL" == crc:
+            crcValue = int.from_bytes(bytes(frame[self.crcLen:self.crcLen + 4]), "little")
+            for byte in range(self.stampLen):
+                if data[byte]:
+                    crcValue ^= self.stampTab[byte][data[byte]]
+            data[self.crcLen:self.crcLen + 4] = list(crcValue.to_bytes(4, "little"))
+
+        bdPar.headStru["Time"] = timeStamp
+        bdPar.headStru["Index"] = index
+        bdPar.headStru["Len"] = 64
+        bdPar.headStru["Type"] = pkgType
+        bdPar.headStru["MorS"] = 0
+        bdPar.frameData = data
+
+        self.patchTime += time.perf_counter() - startTime
+        self.hitNum += 1
+        return True
+
+    def report(self):
+        WriteLog("PreBuild hit-" + str(self.hitNum) + " miss-" + str(self.missNum))
+        if 0 < self.buildCount and 0 < self.hitNum:
+            buildUs = self.buildTime * 1000000 / self.buildCount
+            patchUs = self.patchTime * 1000000 / self.hitNum
+            WriteLog("PreBuild build us-%.1f patch us-%.1f saved ms-%.3f"
+                     % (buildUs, patchUs, (buildUs - patchUs) * self.hitNum / 1000))
+
+
+#--------------------------------------------------------class--------------------------------------------------------#
+class FuzzBloom:
+    #--------------------------property--------------------------#
+    bits = 0
+    table = 0
+    count = 0
+
+    #--------------------------init--------------------------#
+
+    def __init__(self, bits):
+        self.bits = bits
+        self.table = bytearray(bits >> 3)
+        self.count = 0
+
+    #--------------------------interface--------------------------#
+
+    #return True if data maybe sent before, else add it
+    def check_add(self, data):
+        digest = hashlib.blake2b(data, digest_size=12).digest()
+        found = True
+
+        for index in range(3):
+            pos = int.from_bytes(digest[4 * index:4 * index + 4], "little") % self.bits
+            if not (self.table[pos >> 3] & (1 << (pos & 7))):
+                self.table[pos >> 3] |= 1 << (pos & 7)
+                found = False
+
+        if not found:
+            self.count += 1
+        return found
+
+
+#--------------------------------------------------------class--------------------------------------------------------#
+class FuzzParser(BoardParser):
+    #--------------------------property--------------------------#
+    #head field: (offset, byte num)
+    headField = {"Time":(0, 8), "Index":(8, 2), "Len":(10, 2), "Type":(12, 1), "MorS":(13, 1)}
+    crcMode = ("Valid", "CrcM", "Crc", "Both")
+    edgeValue = (0x00, 0x01, 0x55, 0x7F, 0x80, 0xAA, 0xFE, 0xFF)
+    maxRetry = 16
+    board = 0
+    rand = 0
+    bloom = 0
+    startTime = 0
+    templates = {}
+    coverage = {}
+    sendNum = 0
+    dupNum = 0
+
+    #--------------------------init--------------------------#
+
+    def __init__(self, zCanPro, board, seed, bloomBits):
+        self.BoardType = board.BoardType
+        self.zCanPro = zCanPro
+        self.board = board
+        self.channel = board.channel
+        self.rand = random.Random(seed)
+        self.bloom = FuzzBloom(bloomBits)
+        self.templates = board.get_templates()
+        self.coverage = {}
+        self.sendNum = 0
+        self.dupNum = 0
+        self.startTime = clock.now()
+
+    #--------------------------interface--------------------------#
+    def run(self, iniPar, recvData):
+
+        if False == iniPar.IsTestFinish():
+
+            testInfo = iniPar.GetTestInfo()
+            curTest = iniPar.GetCurTest()
+
+            id, data = self.fuzz_frame(testInfo, iniPar.GetCommIndex())
+            if "NULL" != curTest["CandID"]:
+                id = int(curTest["CandID"])
+
+            for sendIndex in range(int(curTest["SendTimes"])):
+                for chaIndex in self.channel[curTest["UseCha"]]:
+                    self.zCanPro.send(chaIndex, id, data)
+
+            self.sendNum += 1
+            iniPar.AddCommIndex()
+
+    #real board frame at comm index with one field mutated, same seed gives same sequence
+    def fuzz_frame(self, testInfo, index):
+        strTypes = sorted(self.templates.keys())
+        board = self.board.make_board_type(testInfo["BoardType"], testInfo["SysAorB"])
+        mOrS = int(testInfo["MorS"], 16) if "Master" == self.board.profile.role else 0
+        timeStamp = int((clock.now() - self.startTime) * 1000)
+
+        for retry in range(self.maxRetry):
+            strType = self.rand.choice(strTypes)
+            id = self.board.make_id(self.BoardType, testInfo["SysAorB"], strType)
+
+            base = self.board.profile.build(self.board.IDPkgType[strType], timeStamp, index, mOrS,
+                                            board, 0x3333, "NULL", "NULL")
+            head = bytearray(base[:14])
+            value = bytearray(base[14:56])
+
+            field = self.rand.choice(list(self.headField.keys()) + ["Value"])
+            if "Value" == field:
+                self.mutate_value(strType, value)
+            else:
+                self.mutate_head(head, field)
+            crcMode = self.rand.choice(self.crcMode)
+            data = self.frame_crc(head, value, crcMode)
+
+            if not self.bloom.check_add(id.to_bytes(4, "little") + data):
+                self.cover("Crc", crcMode)
+                break
+            self.dupNum += 1
+
+        return id, list(data)
+
+    def report(self):
+        WriteLog("Fuzz sent-" + str(self.sendNum) + " unique-" + str(self.bloom.count)
+                          + " dup-" + str(self.dupNum))
+        for field in sorted(self.coverage.keys()):
+            WriteLog("Fuzz cover " + field + "-" + str(len(self.coverage[field])))
+
+    #--------------------------method--------------------------#
+    def cover(self, field, value):
+        if field not in self.coverage:
+            self.coverage[field] = set()
+        self.coverage[field].add(value)
+
+    def mutate_head(self, head, field):
+        offset, byteNum = self.headField[field]
+        maxValue = (1 << (8 * byteNum)) - 1
+        #cover by value class so the coverage set stays bounded
+        edge = self.rand.randrange(6)
+        value = (0, 1, maxValue, maxValue - 1, maxValue >> 1, self.rand.randrange(maxValue + 1))[edge]
+
+        head[offset:offset + byteNum] = value.to_bytes(byteNum, "little")
+        self.cover("Head" + field, edge)
+
+    def mutate_value(self, strType, value):
+        for mutIndex in range(self.rand.randint(1, 3)):
+            offset = self.rand.randrange(len(value))
+
+            if self.rand.randrange(2):
+                value[offset] ^= 1 << self.rand.randrange(8)
+            else:
+                value[offset] = self.rand.choice(self.edgeValue)
+
+            self.cover(strType + "Value", (offset, value[offset]))
+
+    def frame_crc(self, head, value, crcMode):
+        crcm = CalCrcm32Ex(value, len(value), crcm32exInit)
+        if "CrcM" == crcMode or "Both" == crcMode:
+            crcm ^= self.rand.randrange(1, 0x100000000)
+
+        data = head + value + crcm.to_bytes(4, "little")
+
+        crc = CalCrc32Ex(data, len(data), crc32exInit)
+        if "Crc" == crcMode or "Both" == crcMode:
+            crc ^= self.rand.randrange(1, 0x100000000)
+
+        return data + crc.to_bytes(4, "little")
+
+
+#--------------------------------------------------------fault--------------------------------------------------------#
+class FaultRule:
+    #--------------------------property--------------------------#
+    strIndex = 0
+    endIndex = 0xFFFFFFFF
+    pkgType = "NULL"
+    chaList = "NULL"
+    probability = 100
+    action = "NULL"
+    offset = 0
+    value = 0
+    reCrc = "NULL"
+    forgePos = ()
+    swapList = []
+    hitNum = 0
+
+    #--------------------------init--------------------------#
+
+    def __init__(self, section, channel, idPkgType):
+        if "NULL" != section.get("StrIndex", "NULL"):
+            self.strIndex = int(section["StrIndex"])
+        if "NULL" != section.get("EndIndex", "NULL"):
+            self.endIndex = int(section["EndIndex"])
+        if "NULL" != section.get("Probability", "NULL"):
+            self.probability = int(section["Probability"])
+        if "NULL" != section.get("Offset", "NULL"):
+            self.offset = int(section["Offset"], 0)
+        if "NULL" != section.get("Value", "NULL"):
+            self.value = int(section["Value"], 0)
+
+        if "NULL" != section.get("PkgType", "NULL"):
+            self.pkgType = idPkgType[section["PkgType"]]
+        if "NULL" != section.get("UseCha", "NULL"):
+            self.chaList = channel[section["UseCha"]]
+        self.action = section["Action"]
+        self.reCrc = section.get("ReCrc", "NULL")
+        if "Forge" == self.reCrc:
+            pos = int(section.get("ForgePos", "48"), 0)
+            self.forgePos = tuple(range(pos, pos + 8))
+        self.swapList = channel[section.get("SwapGroup", "ChaAll")]
+        self.hitNum = 0
+
+    #--------------------------interface--------------------------#
+    def is_match(self, chaIndex, index, pkgType, rand):
+        if index < self.strIndex or index > self.endIndex:
+            return False
+        if "NULL" != self.pkgType and self.pkgType != pkgType:
+            return False
+        if "NULL" != self.chaList and chaIndex not in self.chaList:
+            return False
+        if 100 > self.probability and rand.randrange(100) >= self.probability:
+            return False
+        return True
+
+    #next channel of SwapGroup, channel not in group kept
+    def swap_cha(self, chaIndex):
+        if chaIndex not in self.swapList:
+            return chaIndex
+        return self.swapList[(self.swapList.index(chaIndex) + 1) % len(self.swapList)]
+
+
+class FaultEngine:
+    #--------------------------property--------------------------#
+    actions = ("BitFlip", "Override", "Drop", "Dup", "Delay", "SwapCha")
+    reCrcs = ("NULL", "CrcM", "Crc", "All", "Forge")
+    #frame layout: head 0-13, value 14-55, crcm 56-59, crc 60-63
+    valueStr = 14
+    crcmStr = 56
+    crcStr = 60
+    frameLen = 64
+    rules = []
+    rand = 0
+
+    #--------------------------init--------------------------#
+
+    def __init__(self, seed):
+        self.rules = []
+        self.rand = random.Random(seed)
+
+    #--------------------------interface--------------------------#
+    def load(self, iniPar, bdPar):
+        faultNum = int(iniPar.GetTestInfo().get("FaultNum", "0"))
+
+        for index in range(faultNum):
+            name = "Fault" + str(index + 1)
+            section = iniPar.GetSection(name)
+
+            if None == section:
+                WriteLog("No " + name)
+                return -1
+
+            try:
+                rule = FaultRule(section, bdPar.channel, bdPar.IDPkgType)
+            except:
+                WriteLog("Less or bad Parm in " + name)
+                return -1
+
+            if rule.action not in self.actions or rule.reCrc not in self.reCrcs:
+                WriteLog("Bad Action or ReCrc in " + name)
+                return -1
+
+            if rule.action in ("BitFlip", "Override") and (0 > rule.offset or self.frameLen <= rule.offset):
+                WriteLog("Bad Offset in " + name + ", frame byte 0-" + str(self.frameLen - 1))
+                return -1
+
+            if "Forge" == rule.reCrc and (14 > rule.forgePos[0] or 55 < rule.forgePos[-1]
+                                          or None == GetCrcForgeInv(rule.forgePos, True, True)):
+                WriteLog("Bad ForgePos in " + name)
+                return -1
+
+            self.rules.append(rule)
+
+        WriteLog("Fault rules: " + str(len(self.rules)))
+        return 0
+
+    def is_empty(self):
+        return 0 == len(self.rules)
+
+    def send(self, zCanPro, chaIndex, id, data, index, pkgType):
+        #clean traffic, same path as without engine
+        frms = [[chaIndex, data]]
+        delay = 0
+
+        for rule in self.rules:
+            if not rule.is_match(chaIndex, index, pkgType, self.rand):
+                continue
+
+            rule.hitNum += 1
+
+            if "Drop" == rule.action:
+                return
+            elif "Dup" == rule.action:
+                for dupIndex in range(max(rule.value, 1)):
+                    frms.append([frms[0][0], frms[0][1]])
+            elif "Delay" == rule.action:
+                delay += rule.value
+            elif "SwapCha" == rule.action:
+                for frm in frms:
+                    frm[0] = rule.swap_cha(frm[0])
+            else:
+                for frm in frms:
+                    frm[1] = self.mutate(frm[1], rule)
+
+        #only these frames held back in tx queue, main loop goes on
+        for frm in frms:
+            zCanPro.send(frm[0], id, frm[1], True, delay)
+
+    def mutate(self, data, rule):
+        frame = bytearray(data)
+
+        if "BitFlip" == rule.action:
+            frame[rule.offset] ^= rule.value & 0xFF
+        else:
+            #little endian like frame_headdata, as many bytes as value needs
+            offset = rule.offset
+            value = rule.value
+            while True:
+                frame[offset] = value & 0xFF
+                value >>= 8
+                offset += 1
+                if 0 == value or offset >= self.frameLen:
+                    break
+
+        if "Forge" == rule.reCrc and self.frameLen == len(frame):
+            #old crcm\crc kept, 8 value bytes at ForgePos changed so both still valid
+            frame[self.crcmStr:] = bytes(data[self.crcmStr:])
+            CalCrcForge(frame, int.from_bytes(frame[self.crcmStr:self.crcStr], "little"),
+                        int.from_bytes(frame[self.crcStr:], "little"), rule.forgePos)
+        elif "NULL" != rule.reCrc and self.frameLen == len(frame):
+            self.fix_crc(data, frame, rule.reCrc)
+
+        return list(frame)
+
+    def report(self):
+        for index in range(len(self.rules)):
+            WriteLog("Fault" + str(index + 1) + " " + self.rules[index].action
+                              + " hit-" + str(self.rules[index].hitNum))
+
+    #--------------------------method--------------------------#
+    def fix_crc(self, oldData, frame, reCrc):
+        if "CrcM" == reCrc or "All" == reCrc:
+            crcm = int.from_bytes(frame[self.crcmStr:self.crcStr], "little")
+            crcm = CalCrcDelta(crcm32TableEx, crcm, oldData, frame, self.valueStr, self.crcmStr)
+            frame[self.crcmStr:self.crcStr] = crcm.to_bytes(4, "little")
+
+        if "Crc" == reCrc or "All" == reCrc:
+            crc = int.from_bytes(frame[self.crcStr:self.frameLen], "little")
+            crc = CalCrcDelta(crc32TableEx, crc, oldData, frame, 0, self.crcStr)
+            frame[self.crcStr:self.frameLen] = crc.to_bytes(4, "little")
+
+
+#--------------------------------------------------------session--------------------------------------------------------#
+class BoardSession:
+    #--------------------------property--------------------------#
+    name = ""
+    replyNum = 1
+    #reply type -> request time, still waiting
+    pending = {}
+    rttStat = 0
+    answerNum = 0
+    missNum = 0
+    unexpectNum = 0
+
+    #--------------------------init--------------------------#
+
+    def __init__(self, name, replyNum):
+        self.name = name
+        self.replyNum = replyNum
+        self.pending = {}
+        self.rttStat = SkewStat("Session " + name + " rtt", SessionTracker.rttBucket)
+
+    #--------------------------interface--------------------------#
+    def request(self, replyTypes, now):
+        for replyType in replyTypes:
+            if replyType in self.pending:
+                self.missNum += 1
+            self.pending[replyType] = now
+
+    def reply(self, replyType, now):
+        reqTime = self.pending.pop(replyType, None)
+        if None == reqTime:
+            self.unexpectNum += 1
+        else:
+            self.answerNum += 1
+            self.rttStat.add(int((now - reqTime) * 1000000))
+
+    def report(self):
+        WriteLog("Session " + self.name + " reply-" + str(self.answerNum) + " miss-" + str(self.missNum)
+                 + " unexpected-" + str(self.unexpectNum) + " pending-" + str(len(self.pending)))
+        self.rttStat.report()
+
+
+class SessionTracker:
+    #--------------------------property--------------------------#
+    rttBucket = (1000, 2000, 5000, 10000, 20000, 50000)
+    #pkg number in id -> type, DO use 5 for Req
+    pkgName = {1:"State", 2:"Ver", 3:"Req", 5:"Req", 6:"Req2"}
+    #request type -> reply types, index by replyNum
+    replyTypes = {"State": ((), ("State",), ("State",)),
+                  "Ver": ((), ("Ver",), ("Ver",)),
+                  "Req": ((), ("Req",), ("Req", "Req2"))}
+    #board type in id -> replyNum
+    boardReplyNum = {3:2, 4:2}
+    boardName = {}
+    sessions = {}
+
+    #--------------------------init--------------------------#
+
+    def __init__(self):
+        self.sessions = {}
+        self.boardName = {}
+        for name, boardType in BoardParser.IDType.items():
+            self.boardName[boardType] = name
+
+    #--------------------------interface--------------------------#
+
+    #boards known before first reply, eg:"DI-A,FI-B"
+    def add_boards(self, boards):
+        for board in boards.split(","):
+            strType, strAB = board.strip().split("-")
+            self.get_session(BoardParser.IDType[strType], BoardParser.IDAorB[strAB])
+
+    #every frame sent or received, id layout 3-1-7
+    def add(self, id, now):
+        boardType = id >> 8
+        pkgName = self.pkgName.get(id & 0x7F)
+        if None == pkgName or boardType not in self.boardName:
+            return
+
+        if 0 == boardType:
+            if pkgName in self.replyTypes:
+                for session in self.sessions.values():
+                    session.request(self.replyTypes[pkgName][session.replyNum], now)
+        else:
+            self.get_session(boardType, (id >> 7) & 1).reply(pkgName, now)
+
+    def report(self):
+        for key in sorted(self.sessions.keys()):
+            self.sessions[key].report()
+
+    #--------------------------method--------------------------#
+    def get_session(self, boardType, aOrB):
+        key = (boardType, aOrB)
+        session = self.sessions.get(key)
+
+        if None == session:
+            session = BoardSession(self.boardName[boardType] + "-" + "AB"[aOrB],
+                                   self.boardReplyNum.get(boardType, 1))
+            self.sessions[key] = session
+        return session
+
+
+#--------------------------------------------------------capture--------------------------------------------------------#
+class FrameCapture:
+    #--------------------------property--------------------------#
+    #bus, is_canfd, data len, can_id, timestamp_us, data 64 byte
+    recordStru = struct.Struct("<BBHIQ64s")
+    file = None
+    frameNum = 0
+
+    #--------------------------init--------------------------#
+
+    def __init__(self, fileName):
+        self.file = open(fileName, "ab", buffering=1 << 20)
+        self.frameNum = 0
+
+    #--------------------------interface--------------------------#
+    def write(self, bus, frm):
+        data = bytes(frm["data"])
+        self.file.write(self.recordStru.pack(bus, frm.get("is_canfd", 1), len(data),
+                                             frm["can_id"], frm["timestamp_us"], data))
+        self.frameNum += 1
+
+    def close(self):
+        self.file.close()
+        WriteLog("Capture frames-" + str(self.frameNum))
+
+
+class FrameDecoder:
+    #--------------------------property--------------------------#
+    #fields straight from FrameCapture record, data start at 16, value start at data 14
+    recordDtype = None
+    if None != numpy:
+        recordDtype = numpy.dtype({
+            "names": ["bus", "is_canfd", "len", "can_id", "timestamp_us",
+                      "Time", "Index", "Len", "Type", "MorS", "board", "sysRunCmd", "CRCM", "CRC"],
+            "formats": ["u1", "u1", "<u2", "<u4", "<u8",
+                        "<u8", "<u2", "<u2", "u1", "u1", "u1", "<u2", "<u4", "<u4"],
+            "offsets": [0, 1, 2, 4, 8,
+                        16, 24, 26, 28, 29, 30, 50, 72, 76],
+            "itemsize": FrameCapture.recordStru.size})
+    chunkRows = 1 << 20
+
+    #--------------------------init--------------------------#
+
+    def __init__(self, chunkRows=1 << 20):
+        if None == numpy:
+            raise ImportError("FrameDecoder need numpy")
+        self.chunkRows = chunkRows
+
+    #--------------------------interface--------------------------#
+
+    #memory map capture file, yield packed record array per chunk
+    def chunks(self, fileName):
+        if 0 == os.path.getsize(fileName):
+            return
+        records = numpy.memmap(fileName, dtype=self.recordDtype, mode="r")
+        for start in range(0, len(records), self.chunkRows):
+            yield self.pack(records[start:start + self.chunkRows])
+
+    def decode(self, fileName):
+        chunkList = list(self.chunks(fileName))
+        if 0 == len(chunkList):
+            return numpy.zeros(0, dtype=self.pack_dtype())
+        return numpy.concatenate(chunkList)
+
+    #frms from zcanpro.receive, all of one bus
+    def decode_frames(self, bus, frms):
+        buf = bytearray()
+        for frm in frms:
+            data = bytes(frm["data"])
+            buf += FrameCapture.recordStru.pack(bus, frm.get("is_canfd", 1), len(data),
+                                                frm["can_id"], frm["timestamp_us"], data)
+        return self.pack(numpy.frombuffer(bytes(buf), dtype=self.recordDtype))
+
+    def save_npy(self, records, fileName):
+        numpy.save(fileName, records)
+
+    def save_csv(self, records, fileName):
+        numpy.savetxt(fileName, records, fmt="%d", delimiter=",", header=",".join(records.dtype.names), comments="")
+
+    #--------------------------method--------------------------#
+    def pack_dtype(self):
+        return numpy.dtype([(name, self.recordDtype.fields[name][0]) for name in self.recordDtype.names])
+
+    #copy strided fields into compact record array
+    def pack(self, records):
+        packed = numpy.empty(len(records), dtype=self.pack_dtype())
+        for name in self.recordDtype.names:
+            packed[name] = records[name]
+        return packed
+
+
+#--------------------------------------------------------history--------------------------------------------------------#
+
+#run results kept in sqlite, written by background thread at test section end
+class RunHistory:
+    #--------------------------property--------------------------#
+    schema = ("CREATE TABLE IF NOT EXISTS run (id INTEGER PRIMARY KEY, start REAL, plan_hash TEXT,"
+              " board TEXT, sys_ab TEXT, mode TEXT, fw_ver TEXT)",
+              "CREATE TABLE IF NOT EXISTS section (run_id INTEGER, test TEXT, start REAL, end REAL)",
+              "CREATE TABLE IF NOT EXISTS counter (run_id INTEGER, test TEXT, name TEXT, value INTEGER)",
+              "CREATE TABLE IF NOT EXISTS stat (run_id INTEGER, test TEXT, name TEXT, num INTEGER,"
+              " sum INTEGER, min INTEGER, max INTEGER)",
+              #bound -1 means >= last bucket bound
+              "CREATE TABLE IF NOT EXISTS hist (run_id INTEGER, test TEXT, name TEXT, bound INTEGER, count INTEGER)",
+              "CREATE INDEX IF NOT EXISTS run_fw ON run (fw_ver)",
+              "CREATE INDEX IF NOT EXISTS run_plan ON run (plan_hash)",
+              "CREATE INDEX IF NOT EXISTS stat_name ON stat (name, run_id)",
+              "CREATE INDEX IF NOT EXISTS hist_name ON hist (name, run_id)",
+              "CREATE INDEX IF NOT EXISTS counter_name ON counter (name, run_id)")
+    fileName = ""
+    queue = 0
+    event = 0
+    thread = 0
+    stopFlag = False
+    #counters and stats at last section end, section rows are the difference
+    lastCounter = {}
+    lastStat = {}
+    lastTime = 0
+    writeNum = 0
+
+    #--------------------------init--------------------------#
+
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.queue = collections.deque()
+        self.event = threading.Event()
+        self.thread = threading.Thread(target=self.__loop, daemon=True)
+        self.lastCounter = {}
+        self.lastStat = {}
+
+    #--------------------------interface--------------------------#
+    def start(self, planHash, board, sysAorB, mode, fwVer):
+        self.lastTime = time.time()
+        self.queue.append(("run", (self.lastTime, planHash, board, sysAorB, mode, fwVer)))
+        self.thread.start()
+
+    #only snapshot in caller thread, rows written later
+    def section(self, testName, counters, stats):
+        now = time.time()
+        counterRows = []
+        for name, value in counters.items():
+            counterRows.append((testName, name, value - self.lastCounter.get(name, 0)))
+        self.lastCounter = counters
+
+        statRows = []
+        histRows = []
+        for stat in stats:
+            last = self.lastStat.get(stat.name, (0, 0, [0] * len(stat.histogram)))
+            statRows.append((testName, stat.name, stat.num - last[0], stat.sum - last[1], None, None))
+            histRows += self.hist_rows(testName, stat, last[2])
+            self.lastStat[stat.name] = (stat.num, stat.sum, stat.histogram[:])
+
+        self.queue.append(("section", ((testName, self.lastTime, now), counterRows, statRows, histRows)))
+        self.lastTime = now
+        self.event.set()
+
+    #whole run as test "All", with min\max
+    def close(self, counters, stats):
+        statRows = []
+        histRows = []
+        for stat in stats:
+            statRows.append(("All", stat.name, stat.num, stat.sum, stat.min, stat.max))
+            histRows += self.hist_rows("All", stat, [0] * len(stat.histogram))
+        counterRows = [("All", name, value) for name, value in counters.items()]
+        self.queue.append(("section", (None, counterRows, statRows, histRows)))
+
+        self.stopFlag = True
+        self.event.set()
+        self.thread.join()
+        WriteLog("History " + self.fileName + " sections-" + str(self.writeNum))
+
+    #--------------------------method--------------------------#
+    def hist_rows(self, testName, stat, last):
+        rows = []
+        for index in range(len(stat.histogram)):
+            bound = stat.bucket[index] if index < len(stat.bucket) else -1
+            rows.append((testName, stat.name, bound, stat.histogram[index] - last[index]))
+        return rows
+
+    #sqlite connection only used in this thread
+    def __loop(self):
+        try:
+            conn = sqlite3.connect(self.fileName)
+            for sql in self.schema:
+                conn.execute(sql)
+        except Exception as err:
+            WriteLog("Cant open history " + self.fileName + " " + str(err))
+            self.queue.clear()
+            return
+
+        runId = 0
+        while True:
+            self.event.wait()
+            self.event.clear()
+
+            with conn:
+                while self.queue:
+                    kind, item = self.queue.popleft()
+                    if "run" == kind:
+                        runId = conn.execute("INSERT INTO run (start, plan_hash, board, sys_ab, mode, fw_ver)"
+                                             " VALUES (?, ?, ?, ?, ?, ?)", item).lastrowid
+                        continue
+
+                    sectionRow, counterRows, statRows, histRows = item
+                    if None != sectionRow:
+                        conn.execute("INSERT INTO section VALUES (?, ?, ?, ?)", (runId,) + sectionRow)
+                        self.writeNum += 1
+                    conn.executemany("INSERT INTO counter VALUES (?, ?, ?, ?)",
+                                     [(runId,) + row for row in counterRows])
+                    conn.executemany("INSERT INTO stat VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                     [(runId,) + row for row in statRows])
+                    conn.executemany("INSERT INTO hist VALUES (?, ?, ?, ?, ?)",
+                                     [(runId,) + row for row in histRows])
+
+            if self.stopFlag and not self.queue:
+                break
+
+        conn.close()
+
+
+#trend across runs, eg:p99 of reply rtt by firmware version
+class HistoryQuery:
+    #--------------------------property--------------------------#
+    groupBy = {"fw":"r.fw_ver", "plan":"r.plan_hash", "board":"r.board || '-' || r.sys_ab", "run":"r.id"}
+    conn = 0
+
+    #--------------------------init--------------------------#
+
+    def __init__(self, fileName):
+        self.conn = sqlite3.connect(fileName)
+
+    #--------------------------interface--------------------------#
+
+    #[(group, name, runs, num, avg, p50, p99, max)]
+    def stats(self, by, name, test, last):
+        key = self.groupBy[by]
+        where = " WHERE s.test = ? AND s.name LIKE ?" + self.last_where(last)
+        args = (test, "%" + name + "%")
+
+        hists = {}
+        for group, statName, bound, count in self.conn.execute(
+                "SELECT " + key + ", s.name, s.bound, SUM(s.count) FROM hist s JOIN run r ON s.run_id = r.id"
+                + where + " GROUP BY 1, 2, 3", args):
+            hists.setdefault((group, statName), []).append((bound, count))
+
+        rows = []
+        for group, statName, runNum, num, total, maxValue in self.conn.execute(
+                "SELECT " + key + ", s.name, COUNT(DISTINCT r.id), SUM(s.num), SUM(s.sum), MAX(s.max)"
+                " FROM stat s JOIN run r ON s.run_id = r.id" + where + " GROUP BY 1, 2 ORDER BY 1, 2", args):
+            if 0 == num:
+                continue
+            hist = hists.get((group, statName), [])
+            #min\max only kept for whole run
+            rows.append((group, statName, runNum, num, total // num, self.percentile(hist, num, 0.5),
+                         self.percentile(hist, num, 0.99), "-" if None == maxValue else maxValue))
+        return rows
+
+    #[(group, name, runs, value)]
+    def counters(self, by, name, test, last):
+        return self.conn.execute(
+            "SELECT " + self.groupBy[by] + ", s.name, COUNT(DISTINCT r.id), SUM(s.value)"
+            " FROM counter s JOIN run r ON s.run_id = r.id WHERE s.test = ? AND s.name LIKE ?"
+            + self.last_where(last) + " GROUP BY 1, 2 ORDER BY 1, 2", (test, "%" + name + "%")).fetchall()
+
+    #--------------------------method--------------------------#
+    def last_where(self, last):
+        if 0 >= last:
+            return ""
+        return " AND r.id IN (SELECT id FROM run ORDER BY id DESC LIMIT " + str(int(last)) + ")"
+
+    #bucket upper bound holding the rank, only as fine as the histogram
+    def percentile(self, hist, num, rank):
+        hist = sorted(hist, key=lambda item: (-1 == item[0], item[0]))
+        need = num * rank
+        count = 0
+        for bound, bucketNum in hist:
+            count += bucketNum
+            if count >= need:
+                if -1 == bound:
+                    return ">=" + str(hist[-2][0]) if 1 < len(hist) else "-"
+                return "<" + str(bound)
+        return "-"
+
+
+#--------------------------------------------------------segment--------------------------------------------------------#
+class SegTransport:
+    #--------------------------property--------------------------#
+    #frame: stream id(1) + seq(2) [+ total len(4) in seq 0] + payload
+    headLen = 3
+    totalLen = 4
+    zCanPro = 0
+    id = 0
+    frameLen = 64
+    rate = 1
+    timeout = 1.0
+    #largest payload sent or accepted, bounded by the 16-bit seq
+    maxLen = 0
+    #rx buffers kept for reuse, each up to maxLen bytes
+    maxBuffers = 16
+    #tx stream: [chaList, stream id, memoryview payload, offset, seq, start time]
+    txStreams = 0
+    #rx stream key (can_id, stream id) -> [buffer, total, offset, next seq, start time, last time]
+    rxStreams = {}
+    rxBuffers = {}
+    #rx stream key dropped, rest of its frames ignored until next seq 0
+    rxDead = set()
+    onPayload = None
+    txNum = 0
+    rxNum = 0
+    errNum = 0
+
+    #--------------------------init--------------------------#
+
+    def __init__(self, zCanPro, id, frameLen, rate, timeoutMs, maxLen=0):
+        self.zCanPro = zCanPro
+        self.id = id
+        self.frameLen = frameLen
+        self.rate = rate
+        self.timeout = timeoutMs / 1000
+        #seq is 16 bits, a wrapped seq 0 would read as a new header on the receiver
+        self.maxLen = (frameLen - self.headLen - self.totalLen) + 0xFFFF * (frameLen - self.headLen)
+        if 0 < maxLen:
+            self.maxLen = min(maxLen, self.maxLen)
+        self.txStreams = collections.deque()
+        self.rxStreams = {}
+        self.rxBuffers = {}
+        self.rxDead = set()
+        self.onPayload = self.log_payload
+
+    #--------------------------interface--------------------------#
+    def send(self, chaList, streamId, payload):
+        if len(payload) > self.maxLen:
+            WriteLog("Seg tx stream-" + str(streamId & 0xFF) + " bytes-" + str(len(payload))
+                     + " over max-" + str(self.maxLen))
+            return -1
+
+        self.txStreams.append([chaList, streamId & 0xFF, memoryview(bytes(payload)), 0, 0, clock.now()])
+        return 0
+
+    def busy(self):
+        return len(self.txStreams)
+
+    #at most rate frames each call, round robin so cyclic frames still get the bus
+    def pump(self):
+        for frameIndex in range(self.rate):
+            if not self.txStreams:
+                break
+
+            stream = self.txStreams.popleft()
+            chaList, streamId, payload, offset, seq = stream[:5]
+
+            data = bytearray([streamId, seq & 0xFF, (seq >> 8) & 0xFF])
+            if 0 == seq:
+                data += len(payload).to_bytes(self.totalLen, "little")
+            size = min(self.frameLen - len(data), len(payload) - offset)
+            data += payload[offset:offset + size]
+            data += bytes(self.frameLen - len(data))
+
+            self.zCanPro.send_group(chaList, self.id, list(data), 64 == self.frameLen)
+            self.txNum += 1
+
+            stream[3] = offset + size
+            stream[4] = seq + 1
+            if stream[3] < len(payload):
+                self.txStreams.append(stream)
+            else:
+                self.log_rate("Seg tx", streamId, len(payload), stream[5])
+
+        self.expire()
+        return len(self.txStreams)
+
+    def feed(self, frm):
+        data = frm["data"]
+        if self.headLen > len(data):
+            return
+
+        self.rxNum += 1
+        streamId = data[0]
+        seq = data[1] | (data[2] << 8)
+        key = (frm["can_id"], streamId)
+        now = clock.now()
+
+        if 0 == seq:
+            total = int.from_bytes(bytes(data[self.headLen:self.headLen + self.totalLen]), "little")
+            #total comes from the wire, never allocate more than a sender may use
+            if total > self.maxLen:
+                self.drop(key, "len-" + str(total))
+                return
+            buffer = self.rxBuffers.get(key)
+            if None == buffer and len(self.rxBuffers) >= self.maxBuffers:
+                for idleKey in [idleKey for idleKey in self.rxBuffers if idleKey not in self.rxStreams]:
+                    del self.rxBuffers[idleKey]
+                if len(self.rxBuffers) >= self.maxBuffers:
+                    self.drop(key, "buffers full")
+                    return
+            if None == buffer or len(buffer) < total:
+                buffer = bytearray(total)
+                self.rxBuffers[key] = buffer
+            stream = [memoryview(buffer), total, 0, 0, now, now]
+            self.rxStreams[key] = stream
+            self.rxDead.discard(key)
+            start = self.headLen + self.totalLen
+        else:
+            if key in self.rxDead:
+                return
+            stream = self.rxStreams.get(key)
+            if None == stream or seq != stream[3]:
+                self.drop(key, "seq-" + str(seq))
+                return
+            start = self.headLen
+
+        size = min(len(data) - start, stream[1] - stream[2])
+        stream[0][stream[2]:stream[2] + size] = bytes(data[start:start + size])
+        stream[2] += size
+        stream[3] = (seq + 1) & 0xFFFF
+        stream[5] = now
+
+        if stream[2] >= stream[1]:
+            del self.rxStreams[key]
+            self.log_rate("Seg rx", streamId, stream[1], stream[4])
+            #view into reused buffer, copy it if kept
+            self.onPayload(frm["can_id"], streamId, stream[0][:stream[1]])
+
+    def report(self):
+        WriteLog("Seg tx frames-" + str(self.txNum) + " rx frames-" + str(self.rxNum) + " error-" + str(self.errNum)
+                 + " tx left-" + str(len(self.txStreams)) + " rx left-" + str(len(self.rxStreams)))
+
+    #--------------------------method--------------------------#
+    def expire(self):
+        if not self.rxStreams:
+            return
+
+        now = clock.now()
+        for key in [key for key, stream in self.rxStreams.items() if now - stream[5] > self.timeout]:
+            self.drop(key, "timeout")
+
+    def drop(self, key, reason):
+        self.rxStreams.pop(key, None)
+        self.rxDead.add(key)
+        self.errNum += 1
+        WriteLog("Seg rx drop id-" + str(key[0]) + " stream-" + str(key[1]) + " " + reason)
+
+    def log_rate(self, name, streamId, size, startTime):
+        useTime = max(clock.now() - startTime, 0.000001)
+        WriteLog(name + " stream-" + str(streamId) + " bytes-" + str(size) + " time-%.1fms" % (useTime * 1000)
+                 + " rate-%.1fKB/s" % (size / useTime / 1024))
+
+    def log_payload(self, id, streamId, payload):
+        WriteLog("Seg payload id-" + str(id) + " stream-" + str(streamId) + " len-" + str(len(payload)))
+
+
+#--------------------------------------------------------schedule--------------------------------------------------------#
+class TimeWheel:
+    #--------------------------property--------------------------#
+    #slots of each level, level n slot spans slotNum^n ticks
+    slotBits = 8
+    levelNum = 4
+    tick = 0.001
+    tickMs = 1
+    curTick = 0
+    startTime = 0
+    wheels = []
+    onTick = None
+    dispatchNum = 0
+
+    #--------------------------init--------------------------#
+
+    #onTick(tick, due streams), default call each stream callback
+    def __init__(self, tickMs, onTick=None):
+        self.tick = tickMs / 1000
+        self.tickMs = tickMs
+        self.onTick = onTick if None != onTick else self.dispatch
+        self.curTick = 0
+        self.startTime = clock.now()
+        self.wheels = [[[] for slot in range(1 << self.slotBits)] for level in range(self.levelNum)]
+
+    #--------------------------interface--------------------------#
+
+    #stream: [period tick, callback(tick), expire tick]
+    def add(self, periodMs, phaseMs, callback):
+        period = max(round(periodMs / self.tickMs), 1)
+        stream = [period, callback, self.curTick + max(round(phaseMs / self.tickMs), 1)]
+        self.insert(stream)
+        return stream
+
+    #run all ticks up to now, streams due in one tick dispatched together
+    def advance(self, now):
+        endTick = int((now - self.startTime) / self.tick)
+
+        while self.curTick < endTick:
+            self.curTick += 1
+            self.cascade()
+
+            slot = self.wheels[0][self.curTick & ((1 << self.slotBits) - 1)]
+            if not slot:
+                continue
+
+            due = slot[:]
+            slot.clear()
+            for stream in due:
+                stream[2] += stream[0]
+                self.insert(stream)
+
+            self.dispatchNum += 1
+            self.onTick(self.curTick, due)
+
+    def dispatch(self, tick, due):
+        for stream in due:
+            stream[1](tick)
+
+    #--------------------------method--------------------------#
+
+    #lowest level whose upper part of expire is the same as current tick, due now goes to current slot
+    def insert(self, stream):
+        expire = stream[2]
+
+        for level in range(self.levelNum):
+            upperBits = self.slotBits * (level + 1)
+            if (expire >> upperBits) == (self.curTick >> upperBits) or level == self.levelNum - 1:
+                slot = (expire >> (self.slotBits * level)) & ((1 << self.slotBits) - 1)
+                self.wheels[level][slot].append(stream)
+                return
+
+    #upper level slot moves down when lower levels wrap
+    def cascade(self):
+        for level in range(1, self.levelNum):
+            if self.curTick & ((1 << (self.slotBits * level)) - 1):
+                break
+            slot = self.wheels[level][(self.curTick >> (self.slotBits * level)) & ((1 << self.slotBits) - 1)]
+            moved = slot[:]
+            slot.clear()
+            for stream in moved:
+                self.insert(stream)
+
+
+class MsgStream:
+    #--------------------------property--------------------------#
+    zCanPro = 0
+    profile = 0
+    id = 0
+    pkgType = 0
+    board = 0
+    mOrS = 0
+    chaList = []
+    index = 0
+    tickMs = 1
+    sendNum = 0
+
+    #--------------------------init--------------------------#
+
+    def __init__(self, zCanPro, section, profileDir, tickMs):
+        bdPar = MakeBoardParser(section["BoardType"], profileDir, zCanPro)
+        if None == bdPar:
+            raise ValueError("BoardType")
+
+        aOrB = BoardParser.IDAorB[section["SysAorB"]]
+        self.zCanPro = zCanPro
+        self.profile = bdPar.profile
+        self.pkgType = self.profile.pkgType[section["PkgType"]]
+        self.id = (self.profile.idType << 8) + (aOrB << 7) + self.pkgType
+        self.board = self.profile.idType * 2 + aOrB
+        self.mOrS = 0xAA if "Master" == self.profile.role else 0
+        if "NULL" != section.get("MorS", "NULL"):
+            self.mOrS = int(section["MorS"], 16)
+        self.chaList = bdPar.channel[section["UseCha"]]
+        self.tickMs = tickMs
+
+    #--------------------------interface--------------------------#
+    def send(self, tick):
+        data = self.profile.build(self.pkgType, int(tick * self.tickMs), self.index, self.mOrS,
+                                  self.board, 0x3333, "NULL", "NULL")
+        self.zCanPro.send_group(self.chaList, self.id, data)
+        self.index = (self.index + 1) & 0xFFFF
+        self.sendNum += 1
+
+
+class MsgStreams:
+    #--------------------------property--------------------------#
+    wheel = 0
+    streams = []
+
+    #--------------------------init--------------------------#
+
+    def __init__(self, tickMs):
+        self.streams = []
+        self.wheel = TimeWheel(tickMs)
+
+    #--------------------------interface--------------------------#
+    def load(self, iniPar, profileDir, zCanPro):
+        for index in range(int(iniPar.GetTestInfo().get("StreamNum", "0"))):
+            name = "Stream" + str(index + 1)
+            section = iniPar.GetSection(name)
+            if None == section:
+                WriteLog("No " + name)
+                return -1
+
+            try:
+                stream = MsgStream(zCanPro, section, profileDir, self.wheel.tick * 1000)
+                self.wheel.add(float(section["Period"]), float(section.get("Phase", "0")), stream.send)
+            except Exception as err:
+                WriteLog("Less or bad Parm in " + name + " " + str(err))
+                return -1
+
+            self.streams.append(stream)
+
+        WriteLog("Msg streams: " + str(len(self.streams)))
+        return 0
+
+    def is_empty(self):
+        return 0 == len(self.streams)
+
+    def poll(self):
+        self.wheel.advance(clock.now())
+
+    def report(self):
+        sendNum = sum(stream.sendNum for stream in self.streams)
+        WriteLog("Msg streams sent-" + str(sendNum) + " busy ticks-" + str(self.wheel.dispatchNum))
+
+
+#--------------------------------------------------------profile--------------------------------------------------------#
+class Profiler:
+    #--------------------------property--------------------------#
+    checkPeriod = 1
+    topNum = 10
+    fileName = "D:/TestComm/TestComm.prof"
+    ctlName = "D:/TestComm/profile.ctl"
+    cmd = "NULL"
+    profile = None
+    checkTime = 0
+
+    #--------------------------init--------------------------#
+
+    def __init__(self, fileName, ctlName):
+        self.fileName = fileName
+        self.ctlName = ctlName
+
+    #--------------------------interface--------------------------#
+
+    #from z_notify thread, done later in z_main thread
+    def request(self, cmd):
+        self.cmd = cmd
+
+    #call in z_main loop
+    def poll(self):
+        now = time.perf_counter()
+        if "NULL" != self.ctlName and now - self.checkTime >= self.checkPeriod:
+            self.checkTime = now
+            self.read_ctl()
+
+        if "NULL" == self.cmd:
+            return
+
+        cmd = self.cmd
+        self.cmd = "NULL"
+
+        if "start" == cmd and None == self.profile:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+            WriteLog("Profile start")
+        elif "stop" == cmd and None != self.profile:
+            self.stop()
+
+    def stop(self):
+        if None == self.profile:
+            return
+
+        self.profile.disable()
+        try:
+            self.profile.dump_stats(self.fileName)
+            WriteLog("Profile stop, stats in " + self.fileName)
+        except:
+            WriteLog("Profile stop, cant write " + self.fileName)
+        self.report()
+        self.profile = None
+
+    #--------------------------method--------------------------#
+
+    #control file content start\stop, removed after read
+    def read_ctl(self):
+        if not os.path.exists(self.ctlName):
+            return
+        try:
+            with open(self.ctlName) as ctlFile:
+                self.cmd = ctlFile.read().strip()
+            os.remove(self.ctlName)
+        except:
+            WriteLog("Cant read " + self.ctlName)
+
+    def report(self):
+        stats = pstats.Stats(self.profile).stats
+        #(file, line, func) -> (prim calls, calls, own time, total time, callers)
+        funcs = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)
+
+        for func, stat in funcs[:self.topNum]:
+            WriteLog("Profile " + func[2] + " " + os.path.basename(func[0]) + ":" + str(func[1])
+                     + " calls-" + str(stat[1]) + " tottime-%.3f" % stat[2] + " cumtime-%.3f" % stat[3])
+
+
 #--------------------------------------------------------canpro--------------------------------------------------------#
 stopTask = False
+profiler = None
+
+class TxQueue:
+    #--------------------------property--------------------------#
+    busID = 0
+    queueLen = 64
+    retryNum = 0
+    backoff = 0.001
+    stale = 0.1
+    queue = 0
+    sendNum = 0
+    maxDepth = 0
+    #busy logged once each time queue fills to half, again after it drains to quarter
+    busy = False
+    #drop count by test section, {"Test1": {"Full":0, "Retry":0, "Stale":0}}
+    dropNum = {}
+    dropLock = 0
+    #delayed frames, heap of (release time, put order, frame, test section)
+    later = []
+    laterNum = 0
+    laterLock = 0
+
+    #--------------------------init--------------------------#
+
+    def __init__(self, busID):
+        self.busID = busID
+        self.queue = collections.deque()
+        self.dropNum = {}
+        self.dropLock = threading.Lock()
+        self.later = []
+        self.laterLock = threading.Lock()
+
+    #--------------------------interface--------------------------#
+    def config(self, queueLen, retryNum, backoffMs, staleMs):
+        self.queueLen = queueLen
+        self.retryNum = retryNum
+        self.backoff = backoffMs / 1000
+        self.stale = staleMs / 1000
+
+    def depth(self):
+        return len(self.queue) + len(self.later)
+
+    #copy, bus worker may add a test section meanwhile
+    def get_drops(self):
+        with self.dropLock:
+            return dict((testName, dict(dropNum)) for testName, dropNum in self.dropNum.items())
+
+    #delay: s, frame joins queue after it, stale time counted from then
+    def put(self, frm, testName, delay=0):
+        if len(self.queue) + len(self.later) >= self.queueLen:
+            self.drop(testName, "Full")
+            return False
+
+        now = clock.now()
+        if 0 < delay:
+            with self.laterLock:
+                heapq.heappush(self.later, (now + delay, self.laterNum, frm, testName))
+                self.laterNum += 1
+            return True
+
+        #[frame, deadline, next try time, retry times, test section]
+        self.queue.append([frm, now + self.stale, now, 0, testName])
+        self.maxDepth = max(len(self.queue), self.maxDepth)
+        #driver saturation, show as soon as queue half full
+        if not self.busy and len(self.queue) >= max(self.queueLen >> 1, 2):
+            self.busy = True
+            WriteLog("Tx queue busy! busID-" + str(self.busID) + " depth-" + str(len(self.queue)))
+        return True
+
+    #send in order, head frame blocks others until sent or dropped
+    def pump(self):
+        if self.later:
+            self.release()
+
+        while self.queue:
+            item = self.queue[0]
+            now = clock.now()
+
+            if now < item[2]:
+                break
+
+            if now > item[1]:
+                self.queue.popleft()
+                self.drop(item[4], "Stale")
+                continue
+
+            if zcanpro.transmit(self.busID, [item[0]]):
+                self.queue.popleft()
+                self.sendNum += 1
+                continue
+
+            WriteLog("Transmit error! busID-" + str(self.busID) + " id-" + str(item[0]["can_id"])
+                     + " data len-" + str(len(item[0]["data"])))
+
+            item[3] += 1
+            if item[3] > self.retryNum:
+                self.queue.popleft()
+                self.drop(item[4], "Retry")
+                continue
+
+            item[2] = now + self.backoff * (1 << (item[3] - 1))
+            break
+
+        if self.busy and len(self.queue) <= (self.queueLen >> 2):
+            self.busy = False
+
+    def report(self):
+        WriteLog("Tx busID-" + str(self.busID) + " sent-" + str(self.sendNum)
+                 + " depth-" + str(len(self.queue)) + " maxDepth-" + str(self.maxDepth))
+        drops = self.get_drops()
+        for testName in sorted(drops.keys()):
+            dropNum = drops[testName]
+            WriteLog("Tx busID-" + str(self.busID) + " " + testName + " drop Full-" + str(dropNum["Full"])
+                     + " Retry-" + str(dropNum["Retry"]) + " Stale-" + str(dropNum["Stale"]))
+
+    #--------------------------method--------------------------#
+    def release(self):
+        now = clock.now()
+        with self.laterLock:
+            while self.later and self.later[0][0] <= now:
+                releaseTime, putNum, frm, testName = heapq.heappop(self.later)
+                self.queue.append([frm, now + self.stale, now, 0, testName])
+
+    def drop(self, testName, reason):
+        with self.dropLock:
+            if testName not in self.dropNum:
+                self.dropNum[testName] = {"Full":0, "Retry":0, "Stale":0}
+            self.dropNum[testName][reason] += 1
+
+
+class SkewStat:
+    #--------------------------property--------------------------#
+    #histogram upper bound of abs skew, us
+    bucket = (10, 50, 100, 500, 1000, 5000)
+    name = ""
+    unit = "us"
+    histogram = []
+    num = 0
+    sum = 0
+    min = 0
+    max = 0
+
+    #--------------------------init--------------------------#
+
+    def __init__(self, name, bucket=None, unit="us"):
+        self.name = name
+        self.unit = unit
+        if None != bucket:
+            self.bucket = bucket
+        self.histogram = [0] * (len(self.bucket) + 1)
+
+    #--------------------------interface--------------------------#
+    def add(self, skew):
+        if 0 == self.num or skew < self.min:
+            self.min = skew
+        if 0 == self.num or skew > self.max:
+            self.max = skew
+        self.num += 1
+        self.sum += skew
+
+        absSkew = abs(skew)
+        for index in range(len(self.bucket)):
+            if absSkew < self.bucket[index]:
+                self.histogram[index] += 1
+                return
+        self.histogram[-1] += 1
+
+    def report(self):
+        if 0 == self.num:
+            return
+
+        WriteLog(self.name + " " + self.unit + " num-" + str(self.num) + " min-" + str(self.min) + " max-" + str(self.max)
+                 + " avg-" + str(self.sum // self.num))
+        msg = self.name + " " + self.unit
+        for index in range(len(self.bucket)):
+            msg += " <" + str(self.bucket[index]) + ":" + str(self.histogram[index])
+        msg += " >=" + str(self.bucket[-1]) + ":" + str(self.histogram[-1])
+        WriteLog(msg)
+
+
+class ChaCorr:
+    #--------------------------property--------------------------#
+    maxPending = 4096
+    windowUs = 100000
+    reportUs = 60000000
+    slotNum = 2
+    #key (can_id, Index) -> [timestamp_us of each slot, data of first copy, copy num, data differ, first timestamp_us]
+    pending = 0
+    skewStat = 0
+    matchNum = 0
+    mismatchNum = 0
+    missNum = []
+    lastUs = 0
+    reportTime = 0
+
+    #--------------------------init--------------------------#
+
+    def __init__(self, windowUs, maxPending, slotNum):
+        self.windowUs = windowUs
+        self.maxPending = maxPending
+        self.slotNum = slotNum
+        self.pending = collections.OrderedDict()
+        self.skewStat = SkewStat("Recv A/B skew")
+        self.missNum = [0] * slotNum
+
+    #--------------------------interface--------------------------#
+
+    #slot: place of the bus in ChaCorrGroup, skew of other slots against slot 0
+    def add(self, slot, frm):
+        data = frm["data"]
+        if 10 > len(data):
+            return
+
+        key = (frm["can_id"], data[8] | (data[9] << 8))
+        stampUs = frm["timestamp_us"]
+        self.lastUs = stampUs
+
+        item = self.pending.get(key)
+        #same channel again before other channels came
+        if None != item and None != item[0][slot]:
+            del self.pending[key]
+            self.miss(item)
+            item = None
+
+        if None == item:
+            item = [[None] * self.slotNum, data, 0, False, stampUs]
+            self.pending[key] = item
+        elif item[1] != data:
+            item[3] = True
+
+        item[0][slot] = stampUs
+        item[2] += 1
+        if self.slotNum == item[2]:
+            del self.pending[key]
+            self.matchNum += 1
+            for otherSlot in range(1, self.slotNum):
+                self.skewStat.add(item[0][otherSlot] - item[0][0])
+            if item[3]:
+                self.mismatchNum += 1
+
+        self.expire()
+
+        if stampUs - self.reportTime >= self.reportUs:
+            self.reportTime = stampUs
+            self.report()
+
+    def report(self):
+        msg = "Recv A/B match-" + str(self.matchNum) + " mismatch-" + str(self.mismatchNum)
+        for slot in range(self.slotNum):
+            msg += " miss " + chr(ord("A") + slot) + "-" + str(self.missNum[slot])
+        WriteLog(msg + " pending-" + str(len(self.pending)))
+        self.skewStat.report()
+
+    #--------------------------method--------------------------#
+
+    #oldest first, frame waited too long means missing on other channels
+    def expire(self):
+        while self.pending:
+            key, item = next(iter(self.pending.items()))
+            if len(self.pending) <= self.maxPending and self.lastUs - item[4] <= self.windowUs:
+                break
+            self.pending.popitem(last=False)
+            self.miss(item)
+
+    def miss(self, item):
+        for slot in range(self.slotNum):
+            if None == item[0][slot]:
+                self.missNum[slot] += 1
+
+
+class ChaSync:
+    #--------------------------property--------------------------#
+    skewUs = 0
+    zCanPro = 0
+    workers = []
+    job = 0
+    #party num -> barrier, one for each group size
+    barriers = {}
+    stamp = []
+    goEvents = []
+    doneEvents = []
+    stopFlag = False
+    skewStat = 0
+
+    #--------------------------init--------------------------#
+
+    def __init__(self, zCanPro, chaNum, skewUs):
+        self.zCanPro = zCanPro
+        self.skewUs = skewUs
+        self.barriers = {}
+        for partyNum in range(2, chaNum + 1):
+            self.barriers[partyNum] = threading.Barrier(partyNum)
+        self.stamp = [0] * chaNum
+        self.goEvents = []
+        self.doneEvents = []
+        self.workers = []
+        self.skewStat = SkewStat("Cha skew")
+
+        for slot in range(chaNum):
+            self.goEvents.append(threading.Event())
+            self.doneEvents.append(threading.Event())
+            self.workers.append(threading.Thread(target=self.__loop, args=(slot,), daemon=True))
+
+    #--------------------------interface--------------------------#
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+
+    def stop(self):
+        self.stopFlag = True
+        for goEvent in self.goEvents:
+            goEvent.set()
+        for worker in self.workers:
+            worker.join()
+
+    #send copies on all channels at the same time, return after all sent
+    def send(self, chaList, id, data):
+        self.job = (chaList, id, data)
+
+        for slot in range(len(chaList)):
+            self.doneEvents[slot].clear()
+            self.goEvents[slot].set()
+        for slot in range(len(chaList)):
+            self.doneEvents[slot].wait()
+
+        for slot in range(1, len(chaList)):
+            self.skewStat.add(int((self.stamp[slot] - self.stamp[0]) * 1000000))
+
+    def report(self):
+        self.skewStat.report()
+
+    #--------------------------method--------------------------#
+    def __loop(self, slot):
+        while True:
+            self.goEvents[slot].wait()
+            self.goEvents[slot].clear()
+            if self.stopFlag:
+                break
+
+            chaList, id, data = self.job
+            self.barriers[len(chaList)].wait()
+
+            #intentional skew on later channels, sleep(0) lets other channel run meanwhile
+            if 0 < self.skewUs and 0 < slot:
+                endTime = time.perf_counter() + self.skewUs * slot / 1000000
+                while time.perf_counter() < endTime:
+                    time.sleep(0)
+
+            self.stamp[slot] = time.perf_counter()
+            self.zCanPro.send(chaList[slot], id, data)
+            self.doneEvents[slot].set()
+
+
+#transmit and receive of one bus in own thread
+class BusWorker:
+    #--------------------------property--------------------------#
+    period = 0.0005
+    busID = 0
+    txQueue = 0
+    recvFlag = False
+    inbox = 0
+    event = 0
+    thread = 0
+    stopFlag = False
+    recvNum = 0
+    errorNum = 0
+
+    #--------------------------init--------------------------#
+
+    def __init__(self, busID, txQueue, recvFlag):
+        self.busID = busID
+        self.txQueue = txQueue
+        self.recvFlag = recvFlag
+        self.inbox = collections.deque()
+        self.event = threading.Event()
+        self.thread = threading.Thread(target=self.__loop, daemon=True)
+
+    #--------------------------interface--------------------------#
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopFlag = True
+        self.event.set()
+        self.thread.join()
+
+    #new frame queued
+    def kick(self):
+        self.event.set()
+
+    #received frames since last take, same as zcanpro.receive
+    def take(self):
+        frms = []
+        while self.inbox:
+            frms.append(self.inbox.popleft())
+        return 1, frms
+
+    def report(self):
+        WriteLog("Bus worker busID-" + str(self.busID) + " recv-" + str(self.recvNum)
+                 + " recv error-" + str(self.errorNum))
+
+    #--------------------------method--------------------------#
+    def __loop(self):
+        while not self.stopFlag:
+            self.event.wait(self.period)
+            self.event.clear()
+            self.txQueue.pump()
+
+            if self.recvFlag:
+                result, frms = zcanpro.receive(self.busID)
+                if result:
+                    self.inbox.extend(frms)
+                    self.recvNum += len(frms)
+                else:
+                    self.errorNum += 1
+
+        self.txQueue.pump()
+
 
 class ZCanPro:
     #--------------------------property--------------------------#
     buses = 0
+    txQueues = []
+    workers = []
+    #group name -> bus index list, eg:{"Cha1":[0], "ChaAll":[0,1]}
+    channel = {}
+    #bus index -> slot in ChaCorr
+    corrSlot = {}
+    testName = "NULL"
+    chaSync = None
+    chaCorr = None
+    capture = None
+    session = None
+    seg = None
+    msgStreams = None
+    history = None
+    #depth seen by each new frame, ChaSync threads send too
+    depthStat = 0
+    depthLock = 0
+    #receive jitter, change of inter-frame period of each can id on channel 0
+    jitterStat = 0
+    recvTime = {}
+    recvPeriod = {}
     __msAID = (0x1, 0x2, 0x3)
     __msBID = (0x81, 0x82, 0x83)
     __pkgType = ("State", "Ver", "Req")
@@ -933,37 +3298,239 @@ class ZCanPro:
 
     def __init__(self):
         self.buses = zcanpro.get_buses()
-        zcanpro.write_log("Get buses: " + str(self.buses))
+        WriteLog("Get buses: " + str(self.buses))
+
+        self.txQueues = []
+        for bus in self.buses:
+            self.txQueues.append(TxQueue(bus["busID"]))
+        self.workers = []
+        self.corrSlot = {}
+        self.testName = "NULL"
+        self.depthStat = SkewStat("Tx depth", (1, 2, 4, 8, 16, 32, 64), "frames")
+        self.depthLock = threading.Lock()
+        self.jitterStat = SkewStat("Recv jitter", (100, 500, 1000, 5000, 10000, 50000))
+        self.recvTime = {}
+        self.recvPeriod = {}
 
     def get_buses(self):
         return self.buses
 
-    def send(self, chaIndex, id, data):
-        frms = [{
+    #Cha1...ChaN and ChaAll from bus num, groups in [Channel] added, eg:Group1 = DUT1:1,2
+    def config_channel(self, section):
+        busNum = len(self.buses)
+        self.channel = {"ChaAll": list(range(busNum))}
+        for busIndex in range(busNum):
+            self.channel["Cha" + str(busIndex + 1)] = [busIndex]
+
+        if None == section:
+            return 0
+
+        for group in section.values():
+            try:
+                name, chaStr = group.split(":")
+                chaList = [int(cha) - 1 for cha in chaStr.split(",")]
+            except ValueError:
+                WriteLog("Bad channel group " + group)
+                return -1
+
+            if 0 > min(chaList) or busNum <= max(chaList):
+                WriteLog("Channel group " + name.strip() + " needs " + str(max(chaList) + 1)
+                         + " can channels, have " + str(busNum))
+                return -1
+            if len(set(chaList)) != len(chaList):
+                WriteLog("Channel group " + name.strip() + " has same channel twice")
+                return -1
+            self.channel[name.strip()] = chaList
+
+        return 0
+
+    def config_tx(self, queueLen, retryNum, backoffMs, staleMs):
+        for txQueue in self.txQueues:
+            txQueue.config(queueLen, retryNum, backoffMs, staleMs)
+
+    #drop count of frames queued from now on goes to this test section
+    def set_test(self, testName):
+        if testName != self.testName:
+            if None != self.history and "NULL" != self.testName:
+                self.history.section(self.testName, self.get_counters(), self.get_stats())
+            self.testName = testName
+            WriteLog("Test section " + testName)
+
+    def start_sync(self, skewUs):
+        self.chaSync = ChaSync(self, len(self.buses), skewUs)
+        self.chaSync.start()
+
+    def stop_sync(self):
+        if None != self.chaSync:
+            self.chaSync.stop()
+            self.chaSync.report()
+            self.chaSync = None
+
+    def start_corr(self, windowUs, maxPending, group):
+        chaList = self.channel.get(group, [])
+        if 2 > len(chaList):
+            WriteLog("ChaCorrGroup " + group + " needs 2 can channels at least!")
+            return -1
+
+        self.corrSlot = {}
+        for slot in range(len(chaList)):
+            self.corrSlot[chaList[slot]] = slot
+        self.chaCorr = ChaCorr(windowUs, maxPending, len(chaList))
+        return 0
+
+    #own thread for each bus, channel 0 received when replies needed, others for correlation or capture
+    def start_workers(self, recvReply):
+        for busIndex in range(len(self.buses)):
+            if 0 == busIndex:
+                recvFlag = recvReply or self.need_recv()
+            else:
+                recvFlag = busIndex in self.corrSlot or None != self.capture
+            self.workers.append(BusWorker(self.buses[busIndex]["busID"], self.txQueues[busIndex], recvFlag))
+            self.workers[-1].start()
+
+    def stop_workers(self):
+        for worker in self.workers:
+            worker.stop()
+            worker.report()
+        self.workers = []
+
+    #recv data not used by board parser, but needed by correlation or capture
+    def need_recv(self):
+        return None != self.chaCorr or None != self.capture or None != self.session or None != self.seg
+
+    #same frame on several channels
+    def send_group(self, chaList, id, data, isCanfd=True):
+        if None != self.chaSync and 1 < len(chaList) and isCanfd:
+            self.chaSync.send(chaList, id, data)
+        else:
+            for chaIndex in chaList:
+                self.send(chaIndex, id, data, isCanfd)
+
+    def send(self, chaIndex, id, data, isCanfd=True, delayMs=0):
+        frm = {
             "can_id": id,              # 帧ID
-            "is_canfd": 1,              # 是否为CANFD数据, 0-CAN, 1-CANFD
-            "canfd_brs": 1,             # CANFD加速, 0-不加速, 1-加速
+            "is_canfd": int(isCanfd),              # 是否为CANFD数据, 0-CAN, 1-CANFD
+            "canfd_brs": int(isCanfd),             # CANFD加速, 0-不加速, 1-加速
             "data": data,    # 数据
             "timestamp_us": 666666      # 时间戳, 微妙
-        }]
-
-        result = zcanpro.transmit(self.buses[chaIndex]["busID"], frms)
-        if not result:
-            zcanpro.write_log("chaIndex-" + str(chaIndex))
-            zcanpro.write_log("id-" + str(id))
-            zcanpro.write_log("data len-" + str(len(data)))
-            zcanpro.write_log("Transmit error!")
+        }
+
+        txQueue = self.txQueues[chaIndex]
+        with self.depthLock:
+            self.depthStat.add(txQueue.depth())
+        if not txQueue.put(frm, self.testName, delayMs / 1000):
+            WriteLog("Tx queue full! chaIndex-" + str(chaIndex) + " depth-" + str(txQueue.depth()))
+        if self.workers:
+            self.workers[chaIndex].kick()
+        else:
+            txQueue.pump()
+
+    #retry frames left in queue, go on with segment and periodic streams
+    def pump(self):
+        depth = 0
+        if None != self.msgStreams:
+            self.msgStreams.poll()
+        if None != self.seg:
+            depth += self.seg.pump()
+        for txQueue in self.txQueues:
+            if not self.workers:
+                txQueue.pump()
+            depth += txQueue.depth()
+        return depth
+
+    #sleep, but keep retrying queued frames meanwhile
+    def wait(self, sleepTime):
+        endTime = clock.now() + sleepTime
+
+        #session rtt need reply time, poll recv meanwhile
+        while 0 < self.pump() or self.need_recv() or None != self.msgStreams:
+            if self.need_recv():
+                self.recv_deal_data()
+            leftTime = endTime - clock.now()
+            if 0 >= leftTime:
+                return
+            clock.sleep(min(leftTime, 0.001))
+
+        leftTime = endTime - clock.now()
+        if 0 < leftTime:
+            clock.sleep(leftTime)
+
+    #run totals so far, for history
+    def get_counters(self):
+        counters = {"TxSent":0, "TxDropFull":0, "TxDropRetry":0, "TxDropStale":0}
+        for txQueue in self.txQueues:
+            counters["TxSent"] += txQueue.sendNum
+            for dropNum in txQueue.get_drops().values():
+                for reason, value in dropNum.items():
+                    counters["TxDrop" + reason] += value
+
+        if None != self.session:
+            for session in self.session.sessions.values():
+                counters["Session " + session.name + " reply"] = session.answerNum
+                counters["Session " + session.name + " miss"] = session.missNum
+                counters["Session " + session.name + " unexpected"] = session.unexpectNum
+        if None != self.chaCorr:
+            counters["Recv A/B match"] = self.chaCorr.matchNum
+            counters["Recv A/B mismatch"] = self.chaCorr.mismatchNum
+            counters["Recv A/B miss"] = sum(self.chaCorr.missNum)
+        return counters
+
+    def get_stats(self):
+        stats = []
+        if None != self.session:
+            stats += [self.session.sessions[key].rttStat for key in sorted(self.session.sessions.keys())]
+        if None != self.chaCorr:
+            stats.append(self.chaCorr.skewStat)
+        if None != self.chaSync:
+            stats.append(self.chaSync.skewStat)
+        stats.append(self.depthStat)
+        stats.append(self.jitterStat)
+        return stats
+
+    def report(self):
+        for txQueue in self.txQueues:
+            txQueue.report()
+        self.depthStat.report()
+        self.jitterStat.report()
+
+    def receive(self, busIndex):
+        if self.workers:
+            return self.workers[busIndex].take()
+        return zcanpro.receive(self.buses[busIndex]["busID"])
 
     def recv_deal_data(self):
 
         recvData = {"type":[], "timeStamp":[]}
 
-        #only use channel 0
-        result, frms = zcanpro.receive(self.buses[0]["busID"])
+        #only use channel 0 for reply, other channels only for A/B correlation and capture
+        if None != self.chaCorr or None != self.capture:
+            for busIndex in range(1, len(self.buses)):
+                if busIndex not in self.corrSlot and None == self.capture:
+                    continue
+                result, frms = self.receive(busIndex)
+                if result:
+                    for frm in frms:
+                        if None != self.chaCorr and busIndex in self.corrSlot:
+                            self.chaCorr.add(self.corrSlot[busIndex], frm)
+                        if None != self.capture:
+                            self.capture.write(busIndex, frm)
+
+        result, frms = self.receive(0)
         if not result:
-            zcanpro.write_log("Receive error!")
+            WriteLog("Receive error!")
         elif len(frms) > 0:
             for dataIndex in range(len(frms)):
+                if None != self.seg and self.seg.id == frms[dataIndex]["can_id"]:
+                    self.seg.feed(frms[dataIndex])
+                    continue
+                if None != self.session:
+                    self.session.add(frms[dataIndex]["can_id"], clock.now())
+                self.add_jitter(frms[dataIndex]["can_id"], clock.now())
+                if None != self.chaCorr and 0 in self.corrSlot:
+                    self.chaCorr.add(self.corrSlot[0], frms[dataIndex])
+                if None != self.capture:
+                    self.capture.write(0, frms[dataIndex])
+
                 for idIndex in range(len(self.__msAID)):
 
                     if self.__msAID[idIndex] == frms[dataIndex]["can_id"] or \
@@ -981,58 +3548,233 @@ class ZCanPro:
 
         return  recvData
 
+    #abs us between this and last period of same can id
+    def add_jitter(self, id, now):
+        if id in self.recvTime:
+            period = now - self.recvTime[id]
+            if id in self.recvPeriod:
+                self.jitterStat.add(int(abs(period - self.recvPeriod[id]) * 1000000))
+            self.recvPeriod[id] = period
+        self.recvTime[id] = now
+
     #--------------------------interface--------------------------#
 
 
+#--------------------------------------------------------sim--------------------------------------------------------#
+
+#stand-in for zcanpro module, frames sent are written to file, master frames made for EXE plans
+class SimBus:
+    #--------------------------property--------------------------#
+    buses = []
+    outFile = None
+    masterAorB = "NULL"
+    masterIndex = 1
+    masterTime = 0.0
+    frameNum = 0
+
+    #--------------------------init--------------------------#
+
+    def __init__(self, outName, masterAorB, busNum=2):
+        self.outFile = open(outName, "w")
+        self.masterAorB = masterAorB
+        self.buses = []
+        for busIndex in range(busNum):
+            self.buses.append({"busID": busIndex + 1, "devType": 0, "devIndex": 0, "chnIndex": busIndex})
+
+    #--------------------------interface--------------------------#
+    def get_buses(self):
+        return self.buses
+
+    def receive(self, busID):
+        frms = []
+
+        if "NULL" != self.masterAorB and self.buses[0]["busID"] == busID:
+            while self.masterTime <= clock.now():
+                frms.append(self.master_frame())
+
+        return 1, frms
+
+    def transmit(self, busID, frms):
+        for frm in frms:
+            self.outFile.write("%.3f,%d,%d,%s\n" % (clock.now() * 1000, busID, frm["can_id"], bytes(frm["data"]).hex()))
+            self.frameNum += 1
+        return 1
+
+    def write_log(self, msg):
+        self.outFile.write("# " + msg + "\n")
+        print(msg)
+
+    def close(self):
+        self.outFile.close()
+
+    #--------------------------method--------------------------#
+
+    #same State\Ver\Req cadence as MSParser
+    def master_frame(self):
+        if self.masterIndex >= 11:
+            if 1 == self.masterIndex % 2:
+                strType, sleepTime = "Req", 0.022
+            else:
+                strType, sleepTime = "State", 0.078
+        elif self.masterIndex >= 6:
+            strType, sleepTime = "Ver", (0.078 if 10 == self.masterIndex else 0.1)
+        else:
+            strType, sleepTime = "State", 0.1
+
+        stampMs = int(self.masterTime * 1000)
+        data = list(stampMs.to_bytes(8, "little")) + list((self.masterIndex & 0xFFFF).to_bytes(2, "little")) \
+               + [64, 0, BoardParser.IDPkgType[strType] & 0xFF, 0xAA] + [0] * 50
+        frm = {"can_id": (BoardParser.IDAorB[self.masterAorB] << 7) + {"State":1, "Ver":2, "Req":3}[strType],
+               "is_canfd": 1, "canfd_brs": 1, "data": data, "timestamp_us": int(self.masterTime * 1000000)}
+
+        self.masterIndex += 1
+        self.masterTime += sleepTime
+        return frm
+
+
 def z_notify(type, obj):
-    zcanpro.write_log("Notify " + str(type) + " " + str(obj))
+    WriteLog("Notify " + str(type) + " " + str(obj))
     if type == "stop":
-        zcanpro.write_log("Stop...")
+        WriteLog("Stop...")
         global stopTask
         stopTask = True
+    elif type == "profile_start":
+        if None != profiler:
+            profiler.request("start")
+    elif type == "profile_stop":
+        if None != profiler:
+            profiler.request("stop")
 
 
 def z_main():
-    zcanpro.write_log("Comm Test Start!")
+    global logSink
+    logSink = LogSink()
+    logSink.start()
+
+    try:
+        return comm_test()
+    finally:
+        logSink.stop()
+        logSink = None
+
+
+def comm_test(iniFile="NULL"):
+    WriteLog("Comm Test Start!")
     global stopTask
+    global profiler
 
 #parse ini file
     iniPar = IniParser()
+    iniPar.SetIniFile(iniFile)
 
     Result = iniPar.ParseIni()
 
     if 0 != Result:
         return Result
 
+    testInfo = iniPar.GetTestInfo()
+    if None != logSink:
+        logSink.config(int(testInfo.get("LogRate", "20")), testInfo.get("LogFile", "NULL"))
+
 #get can bus info
     zCanPro = ZCanPro()
 
+    zCanPro.config_tx(int(testInfo.get("TxQueueLen", "64")), int(testInfo.get("TxRetry", "0")),
+                      float(testInfo.get("TxBackoff", "1")), float(testInfo.get("TxStale", "100")))
+
 #check ini and canbus match
-    if 2 != len(zCanPro.get_buses()):
-        zcanpro.write_log("Dont have 2 can channels!")
+    if 0 != zCanPro.config_channel(iniPar.GetSection("Channel")):
         return
+    #bus worker send only queues, skew would be queue time not bus time
+    if "Yes" == testInfo.get("ChaSync", "No") and "Yes" == testInfo.get("BusWorker", "No"):
+        WriteLog("ChaSync cant work with BusWorker!")
+        return
+
+    for index in range(int(testInfo["TestNum"]) + 1):
+        section = iniPar.GetSection("Test" + str(index)) if 0 < index else testInfo
+        if section["UseCha"] not in zCanPro.channel:
+            WriteLog("Dont have can channel " + section["UseCha"] + "! buses-" + str(len(zCanPro.get_buses())))
+            return
+        if 0 < index and 0 != CheckCrcForge(section["CrcM"], section["Crc"]):
+            WriteLog("Bad CrcM\\Crc forge in Test" + str(index))
+            return
 
 #init Board
     boardType = iniPar.GetTestInfo()["BoardType"]
-    if "MS" == boardType:
-        useBDPar = MSParser(zCanPro)
-    elif "DI" == boardType:
-        useBDPar = DIParser(zCanPro)
-    elif "DO" == boardType:
-        useBDPar = DOParser(zCanPro)
-    elif "FI" == boardType:
-        useBDPar = FIParser(zCanPro)
-    elif "AI" == boardType:
-        useBDPar = AIParser(zCanPro)
-    else:
-        zcanpro.write_log("Cant Find Board Parser")
+    profileDir = testInfo.get("ProfileDir", "NULL")
+    useBDPar = MakeBoardParser(boardType, profileDir, zCanPro)
+    if None == useBDPar:
         return
 
-    zcanpro.write_log("Find Board Parser:" + boardType)
-
-#Run
+    WriteLog("Find Board Parser:" + boardType)
 
     mode = iniPar.GetMode()
+    if "Master" == useBDPar.profile.role:
+        mode = "MS_Mode"
+
+    replyCache = None
+    if "Master" != useBDPar.profile.role and "Yes" == testInfo.get("PreBuild", "No"):
+        replyCache = ReplyCache(int(testInfo.get("PreBuildNum", "2")))
+        useBDPar.replyCache = replyCache
+
+#init fault rules
+    faultEng = FaultEngine(iniPar.GetTestInfo().get("FaultSeed", "0"))
+    if 0 != faultEng.load(iniPar, useBDPar):
+        return
+    if not faultEng.is_empty():
+        useBDPar.faultEng = faultEng
+
+#init fuzz, replace board frames with mutated ones
+    fuzzSeed = iniPar.GetTestInfo().get("FuzzSeed", "NULL")
+    if "NULL" != fuzzSeed:
+        useBDPar = FuzzParser(zCanPro, useBDPar, int(fuzzSeed),
+                              int(iniPar.GetTestInfo().get("FuzzBloomBits", str(1 << 26))))
+        mode = "MS_Mode"
+        WriteLog("Fuzz seed:" + fuzzSeed)
+
+#Run
+    msgStreams = MsgStreams(float(testInfo.get("StreamTick", "1")))
+    if 0 != msgStreams.load(iniPar, profileDir, zCanPro):
+        return
+    if not msgStreams.is_empty():
+        zCanPro.msgStreams = msgStreams
+    if "NULL" != testInfo.get("SegID", "NULL"):
+        zCanPro.seg = SegTransport(zCanPro, int(testInfo["SegID"]), int(testInfo.get("SegFrameLen", "64")),
+                                   int(testInfo.get("SegRate", "1")), float(testInfo.get("SegTimeout", "1000")),
+                                   int(testInfo.get("SegMaxLen", "0")))
+        if "NULL" != testInfo.get("SegSendFile", "NULL"):
+            try:
+                with open(testInfo["SegSendFile"], "rb") as segFile:
+                    if 0 != zCanPro.seg.send(useBDPar.channel[testInfo["UseCha"]], 0, segFile.read()):
+                        return
+            except:
+                WriteLog("Cant read " + testInfo["SegSendFile"])
+    profiler = Profiler(testInfo.get("ProfileFile", "D:/TestComm/TestComm.prof"),
+                        testInfo.get("ProfileCtl", "NULL"))
+    if "Yes" == testInfo.get("Session", "No"):
+        zCanPro.session = SessionTracker()
+        if "NULL" != testInfo.get("SessionBoards", "NULL"):
+            zCanPro.session.add_boards(testInfo["SessionBoards"])
+        if "EXE_Mode" == mode:
+            zCanPro.session.add_boards(testInfo["BoardType"] + "-" + testInfo["SysAorB"])
+    if "NULL" != testInfo.get("CaptureFile", "NULL"):
+        zCanPro.capture = FrameCapture(testInfo["CaptureFile"])
+    if "Yes" == testInfo.get("ChaCorr", "No"):
+        if 0 != zCanPro.start_corr(int(testInfo.get("ChaCorrWindow", "100")) * 1000,
+                                   int(testInfo.get("ChaCorrPending", "4096")), testInfo.get("ChaCorrGroup", "ChaAll")):
+            return
+    if "Yes" == testInfo.get("ChaSync", "No"):
+        zCanPro.start_sync(int(testInfo.get("ChaSkewUs", "0")))
+    if "NULL" != testInfo.get("HistoryFile", "NULL"):
+        zCanPro.history = RunHistory(testInfo["HistoryFile"])
+        zCanPro.history.start(iniPar.GetPlanHash(), testInfo["BoardType"], testInfo["SysAorB"], mode,
+                              testInfo.get("FwVer", "NULL"))
+    if "Yes" == testInfo.get("BusWorker", "No"):
+        zCanPro.start_workers("EXE_Mode" == mode)
+
+    #one run() may pass a whole test section, so change comes from ini parser
+    zCanPro.set_test(iniPar.GetTestName())
+    iniPar.SetTestChange(zCanPro.set_test)
 
     while not stopTask:
 
@@ -1040,14 +3782,116 @@ def z_main():
         if "EXE_Mode" == mode:
             recvData = zCanPro.recv_deal_data()
             if 0 < len(recvData):
-                time.sleep(0.001)
+                clock.sleep(0.001)
         else:
             recvData = "NULL"
+            if zCanPro.need_recv():
+                zCanPro.recv_deal_data()
 
         useBDPar.run(iniPar, recvData)
+        zCanPro.pump()
+        profiler.poll()
 
         if True == iniPar.IsTestFinish():
-            zcanpro.write_log("Comm Test Finish!")
+            WriteLog("Comm Test Finish!")
             break
 
-
+    profiler.stop()
+    profiler = None
+    zCanPro.msgStreams = None
+
+    #give queued retries the stale time to finish
+    while 0 < zCanPro.pump() and not stopTask:
+        clock.sleep(0.001)
+
+    if None != zCanPro.history:
+        counters = zCanPro.get_counters()
+        stats = zCanPro.get_stats()
+        zCanPro.history.section(zCanPro.testName, counters, stats)
+        zCanPro.history.close(counters, stats)
+
+    zCanPro.stop_sync()
+    zCanPro.stop_workers()
+    zCanPro.report()
+    if None != zCanPro.chaCorr:
+        zCanPro.chaCorr.report()
+    if None != zCanPro.capture:
+        zCanPro.capture.close()
+    if None != zCanPro.session:
+        zCanPro.session.report()
+    if None != zCanPro.seg:
+        zCanPro.seg.report()
+    if not msgStreams.is_empty():
+        msgStreams.report()
+    if None != replyCache:
+        replyCache.report()
+    faultEng.report()
+    if "NULL" != fuzzSeed:
+        useBDPar.report()
+
+
+#offline tool, eg:python TestComm.py decode capture.bin --npy capture.npy --csv capture.csv
+#                 python TestComm.py sim plan.ini --out frames.txt
+#                 python TestComm.py history runs.db --name rtt --by fw
+if __name__ == "__main__":
+    import argparse
+
+    argPar = argparse.ArgumentParser(description="TestComm offline tool")
+    subPar = argPar.add_subparsers(dest="cmd", required=True)
+
+    decodePar = subPar.add_parser("decode", help="decode CaptureFile to numpy record array")
+    decodePar.add_argument("capture")
+    decodePar.add_argument("--npy", default="NULL")
+    decodePar.add_argument("--csv", default="NULL")
+    decodePar.add_argument("--chunk", type=int, default=1 << 20)
+
+    simPar = subPar.add_parser("sim", help="run plan on simulated bus in virtual time")
+    simPar.add_argument("plan")
+    simPar.add_argument("--out", default="sim_frames.txt")
+    simPar.add_argument("--buses", type=int, default=2)
+
+    historyPar = subPar.add_parser("history", help="trend of HistoryFile across runs")
+    historyPar.add_argument("history")
+    historyPar.add_argument("--name", default="", help="part of stat or counter name")
+    historyPar.add_argument("--by", default="fw", choices=sorted(HistoryQuery.groupBy.keys()))
+    historyPar.add_argument("--test", default="All", help="test section, eg:All,Test1")
+    historyPar.add_argument("--last", type=int, default=0, help="only last n runs")
+    historyPar.add_argument("--counter", action="store_true", help="show counters instead of stats")
+
+    args = argPar.parse_args()
+
+    if "decode" == args.cmd:
+        decoder = FrameDecoder(args.chunk)
+        records = decoder.decode(args.capture)
+        print("frames:", len(records))
+        if "NULL" != args.npy:
+            decoder.save_npy(records, args.npy)
+        if "NULL" != args.csv:
+            decoder.save_csv(records, args.csv)
+
+    elif "sim" == args.cmd:
+        planPar = configparser.ConfigParser()
+        planPar.read(args.plan)
+        planInfo = planPar["TestInfo"]
+
+        #EXE plans need master frames to reply to
+        masterAorB = "NULL"
+        if "MS" != planInfo["BoardType"]:
+            masterAorB = planInfo["SysAorB"]
+
+        clock = VirtualClock()
+        zcanpro = SimBus(args.out, masterAorB, args.buses)
+        comm_test(args.plan)
+        zcanpro.close()
+        print("frames:", zcanpro.frameNum, "virtual s: %.3f" % clock.now())
+
+    elif "history" == args.cmd:
+        query = HistoryQuery(args.history)
+        if args.counter:
+            print("%-34s %-34s %6s %12s" % (args.by, "counter", "runs", "value"))
+            for row in query.counters(args.by, args.name, args.test, args.last):
+                print("%-34s %-34s %6d %12d" % row)
+        else:
+            print("%-34s %-28s %6s %10s %8s %8s %8s %8s" % (args.by, "stat us\\frames", "runs", "num", "avg", "p50", "p99", "max"))
+            for row in query.stats(args.by, args.name, args.test, args.last):
+                print("%-34s %-28s %6d %10d %8d %8s %8s %8s" % row)